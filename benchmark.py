@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Times the engine's hot paths over a fixed corpus of Microsoft deals and
+random (but seeded) positions, so runs on different versions of
+carddeck.py and freecell.py can be compared.
+
+    ./benchmark.py -o before.json
+    ./benchmark.py -o after.json --compare before.json
+
+Each benchmark reports operations per second, the 50th/90th/99th
+percentile time per operation in microseconds, and the peak memory
+traced while running it once more under tracemalloc.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from freecell import FreecellGame, GameHistory
+
+# the fixture from replaytest.py
+REPLAY_DECK = '7S,5D,QH,JC,5C,AS,5S,8S,QD,9H,KS,7C,2D,3S,JH,8H,QC,10H,2S,KC,4C,3H,6D,9C,KD,8C,5H,8D,QS,AC,6C,6H,JD,JS,4H,10D,9D,10C,10S,9S,AD,KH,4S,7H,7D,6S,3C,AH,2H,4D,3D,2C'
+REPLAY = 'lhaszzjgjgjgjfjgjhrjwjfj;j;l;d;gq;afagfazzzzzzzzq;lglgldlhzzzzzzzzkgfgkfqkaszzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzwjfjas;g;l;d;gq;zzzz'
+
+
+def walk(game, rnd, steps):
+    """plays up to steps random legal moves, returns the positions seen"""
+    states = [game.get_state()]
+    for n in range(steps):
+        moves = game.legal_moves()
+        if not moves:
+            break
+        game.apply(tuple(rnd.choice(moves)))
+        states.append(game.get_state())
+    return states
+
+
+class Corpus(object):
+    """
+    Positions reached by seeded random walks from deals 1 to deals, and
+    the moves of each kind that are legal in them.
+    """
+
+    def __init__(self, deals=50, steps=40, seed=52):
+        rnd = random.Random(seed)
+        self.numbers = list(range(1, deals + 1))
+        self.positions = []
+        self.single_moves = []
+        self.stack_moves = []
+        for number in self.numbers:
+            game = FreecellGame(number=number)
+            for state in walk(game, rnd, steps):
+                game.set_state(state)
+                self.positions.append((number, state))
+                for move in game.legal_moves():
+                    fr, to = move
+                    if fr in game.mv_cols and to in game.mv_cols:
+                        count = game.stack_count(
+                            game.columns[game.mv_cols.index(fr)],
+                            game.columns[game.mv_cols.index(to)],
+                        )
+                        if count > 1:
+                            self.stack_moves.append((number, state, move))
+                            continue
+                    self.single_moves.append((number, state, move))
+        rnd.shuffle(self.single_moves)
+        self.single_moves = self.single_moves[:len(self.positions)]
+
+
+def timed(calls):
+    """runs each (setup, op) pair, timing op, returns the times"""
+    times = []
+    clock = time.perf_counter
+    for setup, op in calls:
+        arg = setup()
+        began = clock()
+        op(arg)
+        times.append(clock() - began)
+    return times
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+def summarize(times, peak):
+    ordered = sorted(times)
+    total = sum(times)
+    return {
+        'ops': len(times),
+        'ops_per_sec': len(times) / total if total else None,
+        'p50_us': percentile(ordered, 50) * 1e6,
+        'p90_us': percentile(ordered, 90) * 1e6,
+        'p99_us': percentile(ordered, 99) * 1e6,
+        'max_us': ordered[-1] * 1e6,
+        'peak_kb': peak / 1024.0,
+    }
+
+
+def games_at(corpus_entries):
+    """one game per deal, reused by the setup functions"""
+    games = {}
+    for entry in corpus_entries:
+        number = entry[0]
+        if number not in games:
+            games[number] = FreecellGame(number=number)
+    return games
+
+
+def bench_deal(corpus):
+    return [(lambda n=n: n, lambda n: FreecellGame(number=n))
+            for n in corpus.numbers]
+
+def bench_moves(entries):
+    games = games_at(entries)
+    def setup(number, state):
+        game = games[number]
+        game.set_state(state)
+        return game
+    return [(lambda n=n, s=s: setup(n, s), lambda game, m=m: game.move(m))
+            for n, s, m in entries]
+
+def bench_undo(corpus):
+    games = games_at(corpus.single_moves)
+    def setup(number, state, move):
+        game = games[number]
+        game.set_state(state)
+        game.move(move)
+        return game
+    return [(lambda n=n, s=s, m=m: setup(n, s, m), lambda game: game.undo())
+            for n, s, m in corpus.single_moves]
+
+def bench_foundation(corpus):
+    games = games_at(corpus.positions)
+    def setup(number, state):
+        game = games[number]
+        game.set_state(state)
+        return game
+    return [(lambda n=n, s=s: setup(n, s),
+             lambda game: game.move_all_to_foundation(record=False))
+            for n, s in corpus.positions]
+
+def bench_draw(corpus):
+    games = games_at(corpus.positions)
+    def setup(number, state):
+        game = games[number]
+        game.set_state(state)
+        return game
+    return [(lambda n=n, s=s: setup(n, s), lambda game: game.draw_board())
+            for n, s in corpus.positions]
+
+def bench_replay(corpus):
+    return [(lambda: FreecellGame(REPLAY_DECK), lambda game: game.move(REPLAY))
+            for n in corpus.numbers]
+
+def bench_save(corpus, history):
+    def save(game):
+        history.save(game, 100)
+    return [(lambda n=n: FreecellGame(number=n), save) for n in corpus.numbers]
+
+def bench_besttimes(corpus, history):
+    return [(lambda: history, lambda h: h.besttimes(10))
+            for n in corpus.numbers]
+
+
+def run(deals=50, steps=40, seed=52, only=None):
+    corpus = Corpus(deals, steps, seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        history = GameHistory(os.path.join(tmp, 'benchmark.db'))
+        try:
+            results = run_benchmarks(corpus, history, only)
+        finally:
+            history.conn.close()
+    return {
+        'datetime': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {'deals': deals, 'steps': steps, 'seed': seed,
+                   'positions': len(corpus.positions)},
+        'results': results,
+    }
+
+
+def run_benchmarks(corpus, history, only=None):
+    history.add_many(
+        {'deck': '', 'time': n, 'moves': n % 200, 'replay': '',
+         'complete': n % 2}
+        for n in range(20000)
+    )
+    benchmarks = [
+        ('deal', lambda: bench_deal(corpus)),
+        ('move_single', lambda: bench_moves(corpus.single_moves)),
+        ('move_stack', lambda: bench_moves(corpus.stack_moves)),
+        ('undo', lambda: bench_undo(corpus)),
+        ('move_all_to_foundation', lambda: bench_foundation(corpus)),
+        ('draw_board', lambda: bench_draw(corpus)),
+        ('replay', lambda: bench_replay(corpus)),
+        ('history_save', lambda: bench_save(corpus, history)),
+        ('history_besttimes', lambda: bench_besttimes(corpus, history)),
+    ]
+    results = {}
+    for name, make in benchmarks:
+        if only and name not in only:
+            continue
+        # move() prints the errors of illegal moves, none are expected
+        with contextlib.redirect_stdout(io.StringIO()):
+            times = timed(make())
+            tracemalloc.start()
+            timed(make())
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[name] = summarize(times, peak)
+    return results
+
+
+def report(run, baseline=None):
+    lines = ['{:<24} {:>12} {:>9} {:>9} {:>9} {:>9}'.format(
+        'benchmark', 'ops/sec', 'p50 us', 'p90 us', 'p99 us', 'peak kb'
+    )]
+    for name, r in run['results'].items():
+        line = '{:<24} {:>12.0f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name, r['ops_per_sec'] or 0, r['p50_us'], r['p90_us'],
+            r['p99_us'], r['peak_kb']
+        )
+        old = baseline and baseline['results'].get(name)
+        if old and old['ops_per_sec'] and r['ops_per_sec']:
+            line += '  {:>6.2f}x'.format(r['ops_per_sec'] / old['ops_per_sec'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage="Usage: %prog [options] [benchmark ...]")
+    parser.add_option('-n', '--deals', type='int', default=50,
+                      help="Number of deals in the corpus")
+    parser.add_option('-s', '--steps', type='int', default=40,
+                      help="Random moves played from each deal")
+    parser.add_option('--seed', type='int', default=52,
+                      help="Seed for the random moves")
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help="Save the results as JSON")
+    parser.add_option('-c', '--compare', metavar='FILE',
+                      help="Show the speedup over results saved with -o")
+    options, args = parser.parse_args()
+
+    results = run(options.deals, options.steps, options.seed, args or None)
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+    print(report(results, baseline))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import random
+import string
 from colorize import colorize
 
 CARDRANKS = (
@@ -50,6 +51,9 @@ class BaseObject(object):
 
 class CardRank(BaseObject):
     """
+    There are only 13 ranks, so CardRank() returns one of the shared
+    instances in RANKS instead of building a new object every time.
+
     >>> rank = CardRank('Ace')
     >>> rank.num
     1
@@ -62,36 +66,38 @@ class CardRank(BaseObject):
     None
     >>> rank.next_rank().prev_rank().label
     'Ace'
+    >>> CardRank('j') is CardRank(11) is RANKS[10]
+    True
     """
     rank = None
 
-    def __init__(self, rank):
+    def __new__(cls, rank):
+        if isinstance(rank, CardRank):
+            return rank
         if isinstance(rank, str):
             rank = rank.title()
-        for r in CARDRANKS:
-            if rank == r or rank in r:
-                self.rank = r
-                break
-        if not self.rank:
+        try:
+            return _RANK_LOOKUP[rank]
+        except (KeyError, TypeError):
             raise InvalidCardRankError(rank)
 
     def next_rank(self, round_the_corner=False):
-        if self.label == 'King':
+        if self.id == 12:
             if round_the_corner:
-                return CardRank('Ace')
+                return RANKS[0]
             else:
                 return None
         else:
-            return CardRank(self.num + 1)
+            return RANKS[self.id + 1]
 
     def prev_rank(self, round_the_corner=False):
-        if self.label == 'Ace':
+        if self.id == 0:
             if round_the_corner:
-                return CardRank('King')
+                return RANKS[12]
             else:
                 return None
         else:
-            return CardRank(self.num - 1)
+            return RANKS[self.id - 1]
 
     @property
     def label(self):
@@ -105,26 +111,46 @@ class CardRank(BaseObject):
     def num(self):
         return self.rank[2]
 
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return self.id
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (CardRank, (self.num,))
+
     def __repr__(self):
         return self.c
 
 
 class CardSuit(BaseObject):
     """
+    Like CardRank, CardSuit() returns one of the four shared instances
+    in SUITS.
+
     >>> h = CardSuit('Hearts')
     >>> h.label
     'Hearts'
+    >>> CardSuit('h') is CardSuit('♡') is SUITS[1]
+    True
     """
     suit = None
 
-    def __init__(self, suit):
+    def __new__(cls, suit):
+        if isinstance(suit, CardSuit):
+            return suit
         if isinstance(suit, str):
-            suit = suit.title().__str__() # prevent UnicodeWarning
-        for s in CARDSUITS:
-            if suit == s or suit in s:
-                self.suit = s
-                break
-        if not self.suit:
+            suit = suit.title()
+        try:
+            return _SUIT_LOOKUP[suit]
+        except (KeyError, TypeError):
             raise InvalidCardSuitError
 
     @property
@@ -155,27 +181,106 @@ class CardSuit(BaseObject):
         else:
             return self.filled_symbol
 
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return self.id
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (CardSuit, (self.c,))
+
     def __repr__(self):
         return self.symbol
 
 
+def _preallocate(cls, attr, values):
+    instances = []
+    for i, value in enumerate(values):
+        obj = object.__new__(cls)
+        setattr(obj, attr, value)
+        obj.id = i
+        instances.append(obj)
+    return tuple(instances)
+
+def _lookup_table(instances, attr):
+    table = {}
+    for obj in instances:
+        value = getattr(obj, attr)
+        table[value] = obj
+        for key in value:
+            table.setdefault(key, obj)
+    return table
+
+RANKS = _preallocate(CardRank, 'rank', CARDRANKS)
+SUITS = _preallocate(CardSuit, 'suit', CARDSUITS)
+_RANK_LOOKUP = _lookup_table(RANKS, 'rank')
+_SUIT_LOOKUP = _lookup_table(SUITS, 'suit')
+
+
 class Card(BaseObject):
     """
+    Each card class has a registry of 52 preallocated cards, and Card()
+    returns the shared instance instead of a new object. The id is
+    suit.id * 13 + rank.id, which is also the order Deck.load_cards uses.
+
     >>> c1 = Card('10','h')
     >>> c2 = Card('7', 'd')
     >>> len(c1.color())== len(c2.color())
     True
+    >>> Card('10', 'h') is c1
+    True
+    >>> c1.id
+    22
+    >>> Card.from_id(22) is c1
+    True
     """
 
-    def __init__(self, rank, suit):
-        if isinstance(rank, CardRank):
-            self.rank = rank
-        else:
-            self.rank = CardRank(rank)
-        if isinstance(suit, CardSuit):
-            self.suit = suit
-        else:
-            self.suit = CardSuit(suit)
+    def __new__(cls, rank, suit):
+        rank = CardRank(rank)
+        suit = CardSuit(suit)
+        return cls.registry()[suit.id * 13 + rank.id]
+
+    @classmethod
+    def registry(cls):
+        try:
+            return cls.__dict__['_registry']
+        except KeyError:
+            cards = []
+            for suit in SUITS:
+                for rank in RANKS:
+                    card = object.__new__(cls)
+                    card.rank = rank
+                    card.suit = suit
+                    card.id = suit.id * 13 + rank.id
+                    cards.append(card)
+            cls._registry = tuple(cards)
+            return cls._registry
+
+    @classmethod
+    def from_id(cls, id):
+        return cls.registry()[id]
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.id == other.id
+
+    def __hash__(self):
+        return self.id
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (self.rank.num, self.suit.c))
 
     def color(self, width=8):
         color = self.suit.color
@@ -300,6 +405,31 @@ class CardStack(BaseObject):
             raise InvalidCardStackAdditionError
 
 
+Card.registry()
+
+
+# Decks can also be written as one letter per card, the card id-th letter
+# of DECK_LETTERS, so a full deck is a 52 character string.
+DECK_LETTERS = string.ascii_letters
+DECK_LETTER_IDS = dict((l, n) for n, l in enumerate(DECK_LETTERS))
+
+# text codes ('AS', '10H') by card id, and card ids by text code
+CARD_CODES = tuple(r.c + s.c for s in SUITS for r in RANKS)
+CARD_CODE_IDS = dict((code, n) for n, code in enumerate(CARD_CODES))
+
+def is_compact(string):
+    """
+    Whether a deck string is in the one letter per card format. Text decks
+    always have a comma, so a deck of one card is written 'AS,'.
+
+    >>> is_compact('ab'), is_compact('abc'), is_compact('')
+    (True, True, True)
+    >>> is_compact('AS,'), is_compact('AS,10H')
+    (False, False)
+    """
+    return ',' not in string
+
+
 class Deck(BaseObject):
     """
     >>> deck = Deck()
@@ -316,8 +446,28 @@ class Deck(BaseObject):
     >>> new_deck.loads(as_str)
     >>> new_deck.__repr__() == deck.__repr__()
     True
+    >>> deck = Deck()
+    >>> deck.dumps()
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    >>> new_deck.loads(deck.dumps())
+    >>> new_deck.__repr__() == deck.__repr__()
+    True
+
+    Short decks keep their format
+    >>> new_deck.loads('ab')
+    >>> new_deck.__repr__()
+    'AS,2S'
+    >>> new_deck.loads('abc')
+    >>> new_deck.dumps()
+    'abc'
+    >>> new_deck.loads('10H,')
+    >>> new_deck.__repr__(), new_deck.dumps()
+    ('10H,', 'w')
     """
 
+    # the class of the cards dealt
+    card_class = Card
+
     def __init__(self, number_of_decks=1):
         self.cards = []
         self.used = []
@@ -328,9 +478,7 @@ class Deck(BaseObject):
         return self
 
     def load_cards(self):
-        for suit in CARDSUITS:
-            for rank in CARDRANKS:
-                self.cards.append(Card(rank, suit))
+        self.cards.extend(self.card_class.registry())
 
     def shuffle(self):
         random.shuffle(self.cards)
@@ -363,17 +511,35 @@ class Deck(BaseObject):
         return hands
 
     def loads(self, string, overwrite=True):
+        """
+        Adds the cards in string, either the text format of __repr__()
+        or the one letter per card format of dumps().
+        """
         if overwrite:
             self.cards = []
-        cards = string.split(',')
-        for c in cards:
-            rank = c[:-1]
-            suit = c[-1]
-            self.cards.append(Card(rank,suit))
-
+        registry = self.card_class.registry()
+        if is_compact(string):
+            self.cards.extend([registry[DECK_LETTER_IDS[l]] for l in string])
+            return
+        for c in string.split(','):
+            if not c:
+                # after the one card of a short deck, 'AS,'
+                continue
+            try:
+                self.cards.append(registry[CARD_CODE_IDS[c]])
+            except KeyError:
+                # other spellings, like '5h'
+                card = self.card_class(c[:-1], c[-1])
+                self.cards.append(registry[card.id])
+
+    def dumps(self):
+        """the cards as a string of one letter per card"""
+        return ''.join([DECK_LETTERS[c.id] for c in self.cards])
 
     def __repr__(self):
-        return ','.join(['{}{}'.format(c.rank.c,c.suit.c) for c in self.cards])
+        codes = [CARD_CODES[c.id] for c in self.cards]
+        # a comma even for one card, to tell it from the dumps() format
+        return ','.join(codes) + (',' if len(codes) == 1 else '')
 
 
 
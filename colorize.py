@@ -34,8 +34,29 @@ def variant_number(variant_string):
         if p[1].match(variant_string):
             return p[0]
 
-def colorize(text, fg='def', bg='def', var='def', bgalt=False, debug=False):
-    tpl = '\033[{color}m{text}\033[m'
+# SGR parameters by (fg, bg, var, bgalt), filled in as styles are used
+_codes = {}
+
+def escape_code(fg='def', bg='def', var='def', bgalt=False):
+    """
+    SGR parameters for a style, worked out once and then kept in _codes
+
+    >>> escape_code('red', 'white', 'bold', bgalt=True)
+    '1;31;107'
+    >>> ('red', 'white', 'bold', True) in _codes
+    True
+    >>> code = _codes['red', 'white', 'bold', True]
+    >>> escape_code('red', 'white', 'bold', bgalt=True) is code
+    True
+    >>> escape_code()
+    '0'
+    """
+    key = (fg, bg, var, bgalt)
+    try:
+        return _codes[key]
+    except KeyError:
+        pass
+
     fgc = color_number(fg)
     bgc = color_number(bg)
     vnm = variant_number(var)
@@ -49,10 +70,37 @@ def colorize(text, fg='def', bg='def', var='def', bgalt=False, debug=False):
         bgnm = '10' if bgalt else '4'
         whole = '{};{}{}'.format(whole, bgnm, bgc)
 
+    _codes[key] = whole
+    return whole
+
+def colorize(text, fg='def', bg='def', var='def', bgalt=False, debug=False):
+    whole = escape_code(fg, bg, var, bgalt)
+
     if debug:
         print(whole)
 
-    return tpl.format(color=whole, text=text)
+    return '\033[{}m{}\033[m'.format(whole, text)
+
+def colorize_many(texts, fg='def', bg='def', var='def', bgalt=False):
+    """
+    colorize each of texts in the same style, returns a list
+
+    >>> styles = [{}, {'fg': 'red'}, {'fg': 'blk', 'bg': 'whi', 'bgalt': True},
+    ...           {'fg': 'grn', 'var': 'und'}, {'bg': 'blu', 'var': 'rev'}]
+    >>> all(colorize_many(['A', '10'], **style) ==
+    ...     [colorize('A', **style), colorize('10', **style)]
+    ...     for style in styles)
+    True
+
+    Styles used before come from the cache
+    >>> cached = len(_codes)
+    >>> colorize_many(['J'], fg='red') == [colorize('J', fg='red')]
+    True
+    >>> len(_codes) == cached
+    True
+    """
+    prefix = '\033[{}m'.format(escape_code(fg, bg, var, bgalt))
+    return ['{}{}\033[m'.format(prefix, text) for text in texts]
 
 if __name__ == '__main__':
     from optparse import OptionParser
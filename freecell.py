@@ -1,12 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import copy
+import csv
+import itertools
+import json
 import os
+import random
+import sys
 import sqlite3
 import pprint
+import queue
+import threading
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import Future
 from colorize import colorize
-from carddeck import Card, CardStack, Deck, CardSuit, CardRank
+from carddeck import Card, CardStack, Deck, CardSuit, CardRank, is_compact, \
+    CardNotInStackError, InvalidCardStackAdditionError
 
 BANNER = """
       .*.*                                                    .*  .*
@@ -20,14 +31,89 @@ by @katylava
 
 class FreecellCard(Card):
 
-    def __init__(self, rank, suit):
-        super(FreecellCard, self).__init__(rank, suit)
-
     def draw(self, width=8):
         color = self.suit.color
         text = '{:>2}{:<2} '.format(self.rank.c, self.suit.filled_symbol)
         return colorize(text.rjust(width), fg=color, bg='white', var='und', bgalt=True)
 
+FreecellCard.registry()
+
+
+# Microsoft FreeCell deal numbers. Deals 1 to 32000 are the original
+# game, and the same generator gives the extended deals up to 2**33 - 1
+# that FreeCell Pro and most solvers use.
+MS_MAX_DEAL = 0x1ffffffff
+
+# MS card numbers go A-K with suits in CDHS order within each rank
+MS_CARD_IDS = [(3 - m % 4) * 13 + m // 4 for m in range(52)]
+
+def ms_deal(number):
+    """
+    Card ids of Microsoft deal number, in the order they are dealt (left
+    to right, one row at a time).
+
+    >>> cards = FreecellCard.registry()
+    >>> ' '.join(cards[c].code for c in ms_deal(1)[:8])
+    'JD 2D 9H JC 5D 7H 7C 5H'
+    >>> ' '.join(cards[c].code for c in ms_deal(617)[-4:])
+    'JD KS KC 4H'
+    """
+    if not 1 <= number <= MS_MAX_DEAL:
+        raise ValueError('No Microsoft deal #{}'.format(number))
+    seed = number if number < 0x100000000 else number - 0x100000000
+    deck = list(range(51, -1, -1))
+    for i in range(51):
+        seed = (seed * 214013 + 2531011) & 0xffffffff
+        if number < 0x80000000:
+            r = (seed >> 16) & 0x7fff
+        elif number < 0x100000000:
+            r = ((seed >> 16) & 0x7fff) | 0x8000
+        else:
+            r = ((seed >> 16) & 0xffff) + 1
+        j = 51 - r % (52 - i)
+        deck[i], deck[j] = deck[j], deck[i]
+    return [MS_CARD_IDS[m] for m in deck]
+
+def ms_deals(first, count):
+    """
+    Deals first to first + count - 1 at once, as a numpy array with one
+    row of card ids per deal in the same order as ms_deal(). Needs numpy,
+    which is only imported here; ms_deal() works without it.
+
+    >>> try:
+    ...     deals = ms_deals(1, 1000)
+    ... except ImportError:
+    ...     pass
+    ... else:
+    ...     assert deals.shape == (1000, 52)
+    ...     assert list(deals[616]) == ms_deal(617)
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('ms_deals() needs numpy')
+    number = numpy.arange(first, first + count, dtype=numpy.uint64)
+    if count and not (1 <= first and first + count - 1 <= MS_MAX_DEAL):
+        raise ValueError('No Microsoft deals #{}-{}'.format(
+            first, first + count - 1))
+    high = number >= 0x100000000
+    seed = numpy.where(high, number - 0x100000000, number)
+    bit15 = numpy.where(number >= 0x80000000, 0x8000, 0).astype(numpy.uint64)
+    rows = numpy.arange(count)
+    deck = numpy.tile(numpy.arange(51, -1, -1, dtype=numpy.uint8), (count, 1))
+    for i in range(51):
+        seed = (seed * 214013 + 2531011) & 0xffffffff
+        r = numpy.where(
+            high,
+            ((seed >> 16) & 0xffff) + 1,
+            ((seed >> 16) & 0x7fff) | bit15,
+        )
+        j = (51 - r % (52 - i)).astype(numpy.intp)
+        swap = deck[rows, j]
+        deck[rows, j] = deck[:, i]
+        deck[:, i] = swap
+    return numpy.array(MS_CARD_IDS, dtype=numpy.uint8)[deck]
+
 
 class FreecellDeck(Deck):
     """
@@ -37,19 +123,27 @@ class FreecellDeck(Deck):
     >>> card = deck.next()
     >>> isinstance(card, FreecellCard)
     True
+    >>> deck = FreecellDeck(number=1)
+    >>> deck.next().code
+    'JD'
+    >>> compact = FreecellDeck(number=1).dumps()
+    >>> compact[-3:]
+    'vBK'
+    >>> game = FreecellGame(compact)
+    >>> game.deck.reset()
+    >>> game.deck.__repr__() == FreecellDeck(number=1).__repr__()
+    True
     """
 
-    def __init__(self):
-        super(FreecellDeck, self).__init__()
-        self._mapcards()
-
-    def loads(self, string):
-        super(FreecellDeck, self).loads(string)
-        self._mapcards()
+    card_class = FreecellCard
 
-    def _mapcards(self):
-        basic_cards = self.cards
-        self.cards = [FreecellCard(c.rank, c.suit) for c in basic_cards]
+    def __init__(self, number=None):
+        super(FreecellDeck, self).__init__()
+        self.number = number
+        if number:
+            registry = FreecellCard.registry()
+            # deal() takes cards from the end of the deck
+            self.cards = [registry[c] for c in reversed(ms_deal(number))]
 
 
 class NoFreecellsError(Exception):
@@ -71,6 +165,78 @@ class FreecellInvalidMoveError(Exception):
     pass
 
 
+RED_SUITS = (1, 2)
+
+def safe_to_foundation(card, foundation):
+    """
+    Whether the card with id card can go to the foundations without
+    leaving anything that might still need to be built on it. foundation
+    is the number of cards on each foundation in suit id order. Aces and
+    twos are always safe, anything else once both foundations of the
+    opposite color are no more than one rank behind.
+    """
+    suit, rank = divmod(card, 13)
+    if foundation[suit] != rank:
+        return False
+    if rank <= 1:
+        return True
+    if suit in RED_SUITS:
+        return foundation[0] >= rank and foundation[3] >= rank
+    return foundation[1] >= rank and foundation[2] >= rank
+
+
+# FreecellGame.apply() results
+MOVE_OK = 0
+MOVE_ILLEGAL = 1    # the rules don't allow it
+MOVE_EMPTY = 2      # no card in the pile to move from
+MOVE_UNKNOWN = 3    # not a move letter
+
+
+# every letter that appears in FreecellGame.replay, in code order
+REPLAY_LETTERS = 'asdfjkl;qwergtuiopyhzm'
+REPLAY_CODES = dict((l, n) for n, l in enumerate(REPLAY_LETTERS))
+
+def pack_replay(replay):
+    """
+    Packs a list of two-letter moves into bytes, five bits per letter.
+
+    >>> packed = pack_replay(['aq', ';y', 'zz', 'yy'])
+    >>> len(packed)
+    5
+    >>> unpack_replay(packed)
+    ['aq', ';y', 'zz', 'yy']
+    """
+    packed = bytearray()
+    buffer = bits = 0
+    for move in replay:
+        for letter in move:
+            buffer = buffer << 5 | REPLAY_CODES[letter]
+            bits += 5
+            if bits >= 8:
+                bits -= 8
+                packed.append(buffer >> bits)
+                buffer &= (1 << bits) - 1
+    if bits:
+        # pad the last byte with zeros
+        packed.append(buffer << 8 - bits)
+    return bytes(packed)
+
+def unpack_replay(packed):
+    """list of moves from pack_replay() bytes"""
+    letters = []
+    buffer = bits = 0
+    for byte in packed:
+        buffer = buffer << 8 | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            letters.append(REPLAY_LETTERS[buffer >> bits])
+            buffer &= (1 << bits) - 1
+    # the padding can make up a letter or two
+    count = len(packed) * 8 // 10
+    return [letters[n] + letters[n + 1] for n in range(0, count * 2, 2)]
+
+
 class FoundationPile(CardStack):
     """
     >>> deck = FreecellDeck()
@@ -108,14 +274,10 @@ class FoundationPile(CardStack):
             raise InvalidFoundationCardError(msg)
 
     def next_card(self):
-        top = self.top_card()
-        if not top:
-            return FreecellCard(rank=CardRank('Ace'), suit=self.suit)
-        else:
-            if top.rank.label == 'King':
-                return None
-            else:
-                return FreecellCard(top.rank.next_rank(), suit=self.suit)
+        length = len(self.cards)
+        if length == 13:
+            return None
+        return FreecellCard.from_id(self.suit.id * 13 + length)
 
     def __repr__(self):
         if self.length == 0:
@@ -170,11 +332,37 @@ class AltDescCardColumn(CardStack):
     True
     """
 
+    # a FreecellGame watches its columns to keep count of empty ones
+    watcher = None
+    slot = None
+
+    @property
+    def cards(self):
+        return self._cards
+
+    @cards.setter
+    def cards(self, cards):
+        # _runs[i] is the length of the ordered run ending at card i
+        self._cards = list(cards)
+        self._runs = []
+        for i, card in enumerate(self._cards):
+            if i and self._fits(card, self._cards[i - 1]):
+                self._runs.append(self._runs[-1] + 1)
+            else:
+                self._runs.append(1)
+        if self.watcher:
+            self.watcher.column_occupied(self.slot, bool(self._cards))
+
+    def watch(self, watcher, slot):
+        self.watcher = watcher
+        self.slot = slot
+        watcher.column_occupied(slot, bool(self._cards))
+
     def top_stack(self, length=None):
-        clone = copy.deepcopy(self)
-        while not clone.valid() or (length and clone.length > length):
-            clone.cards.pop(0)
-        return clone
+        run = self.run_length()
+        if length and run > length:
+            run = length
+        return self.__class__(self._cards[len(self._cards) - run:])
 
     def add_card(self, card, force=False):
         if force or self.allow_card(card):
@@ -198,33 +386,120 @@ class AltDescCardColumn(CardStack):
         if not top:
             return True
         else:
-            return card.rank == top.rank.prev_rank() \
+            return card.rank.id == top.rank.id - 1 \
                    and not card.is_same_color_as(top)
 
     def top_stack_for(self, card):
-        stack = self.top_stack()
-        if card:
-            temp = self.__class__([card])
-            while stack.length > 0 and not temp.allow_stack(stack):
-                stack.cards.pop(0)
-        return None if stack.length == 0 else stack
+        if not card:
+            stack = self.top_stack()
+            return None if stack.length == 0 else stack
+        count = self.count_for(card)
+        if not count:
+            return None
+        return self.__class__(self._cards[-count:])
+
+    def count_for(self, card):
+        """
+        Number of cards in the top run that would move onto card, or 0 if
+        no part of the run fits on it.
+        """
+        top = self.top_card()
+        if not top:
+            return 0
+        count = card.rank.id - top.rank.id
+        if 1 <= count <= self.run_length() \
+                and self._fits(self._cards[-count], card):
+            return count
+        return 0
 
     def remove_top_stack(self, length=None):
-        bottom_card = self.top_stack(length).bottom_card()
-        return self.slice_stack(bottom_card)
+        return self.pop_stack(self.top_stack(length).length)
 
     def remove_top_stack_for(self, card):
-        bottom_card = self.top_stack_for(card).bottom_card()
-        return self.slice_stack(bottom_card)
+        return self.pop_stack(self.count_for(card))
+
+    def pop_stack(self, length):
+        index = len(self._cards) - length
+        stack = self.__class__(self._cards[index:])
+        del self._cards[index:]
+        del self._runs[index:]
+        if not index and self.watcher:
+            self.watcher.column_occupied(self.slot, False)
+        return stack
+
+    def slice_stack(self, card):
+        try:
+            index = self._cards.index(card)
+        except ValueError:
+            raise CardNotInStackError
+        else:
+            return self.pop_stack(len(self._cards) - index)
+
+    def remove_top_card(self):
+        self._runs.pop()
+        card = self._cards.pop()
+        if not self._cards and self.watcher:
+            self.watcher.column_occupied(self.slot, False)
+        return card
+
+    def run_length(self):
+        """number of cards in the ordered run on top of the column"""
+        return self._runs[-1] if self._runs else 0
+
+    @staticmethod
+    def _fits(card, onto):
+        return card.rank.id == onto.rank.id - 1 \
+               and not card.is_same_color_as(onto)
 
     def valid(self):
-        temp = self.__class__([])
-        for c in self.cards:
-            try:
-                temp.add_card(c)
-            except InvalidColumnCardError:
-                return False
-        return True
+        return not self._runs or self._runs[-1] == len(self._cards)
+
+    def __add__(self, other):
+        if isinstance(other, self.__class__):
+            for card in other.cards:
+                self._push(card)
+        elif isinstance(other, Card):
+            self._push(other)
+        else:
+            raise InvalidCardStackAdditionError
+
+    def _push(self, card):
+        if self._cards and self._fits(card, self._cards[-1]):
+            self._runs.append(self._runs[-1] + 1)
+        else:
+            if not self._cards and self.watcher:
+                self.watcher.column_occupied(self.slot, True)
+            self._runs.append(1)
+        self._cards.append(card)
+
+
+BIT_COUNT = [bin(n).count('1') for n in range(256)]
+# FITS[card][onto] for card ids: card can go on onto in a column
+FITS = [[card % 13 == onto % 13 - 1
+         and (card // 13 in RED_SUITS) != (onto // 13 in RED_SUITS)
+         for onto in range(52)] for card in range(52)]
+FIRST_CLEAR_BIT = [((n + 1) & ~n).bit_length() - 1 for n in range(15)]
+
+
+class FreecellSlot(CardStack):
+    """
+    A single free cell. It keeps the occupied bitmask of its Freecells up
+    to date as cards are added and removed.
+    """
+
+    def __init__(self, freecells, position):
+        super(FreecellSlot, self).__init__([], 1)
+        self.freecells = freecells
+        self.position = position
+
+    def __add__(self, other):
+        super(FreecellSlot, self).__add__(other)
+        self.freecells.occupied |= 1 << self.position
+
+    def remove_top_card(self):
+        card = self.cards.pop()
+        self.freecells.occupied &= ~(1 << self.position)
+        return card
 
 
 class Freecells:
@@ -235,12 +510,10 @@ class Freecells:
     >>> five_hearts = FreecellCard('5', 'Hearts')
     >>> fcs.add_card(five_hearts) # returns position card was added to
     0
-    >>> fcs.get_card_at_position(0) == fcs.empty_cell
+    >>> fcs.get_card_at_position(0) is None
     False
     >>> fcs.cells
     [5♡, , , ]
-    >>> fcs.empty_cell == CardStack([], 1)
-    True
     >>> fcs.free()
     3
     >>> fcs.get_card_at_position(0) == five_hearts
@@ -256,19 +529,25 @@ class Freecells:
     [5♡, , , 2♡]
     >>> fcs.all_cards()
     [5♡ , None, None, 2♡ ]
+    >>> bin(fcs.occupied)
+    '0b1001'
+    >>> fcs.remove_card(five_hearts)
+    >>> fcs.first_open()
+    0
     """
-    empty_cell = CardStack([], 1)
 
     def __init__(self):
-        self.cells = []
-        for n in range(0,4):
-            self.cells.append(copy.deepcopy(self.empty_cell))
+        # bit n is set while cell n holds a card
+        self.occupied = 0
+        self.cells = [FreecellSlot(self, n) for n in range(0,4)]
 
     def free(self):
-        return self.cells.count(self.empty_cell)
+        return 4 - BIT_COUNT[self.occupied]
 
     def first_open(self):
-        return self.cells.index(self.empty_cell)
+        if self.occupied == 0b1111:
+            raise ValueError('No open free cell')
+        return FIRST_CLEAR_BIT[self.occupied]
 
     def all_cards(self):
         return [stack.top_card() for stack in self.cells]
@@ -294,10 +573,75 @@ class Freecells:
         return card
 
     def remove_card(self, card):
-        position = self.cells.index(CardStack([card], 1))
+        position = self.all_cards().index(card)
         self.cells[position].remove_top_card()
 
 
+class Board(namedtuple('Board', 'foundation cells columns')):
+    """
+    An immutable board. foundation is bytes of the number of cards on each
+    foundation in FreecellGame.mv_found_order, cells is bytes of the four
+    free cells and columns is a tuple of bytes, one per column, with each
+    card stored as its id + 1 so that 0 can mean an empty cell.
+
+    FreecellGame.board() only encodes the piles moved since the board
+    before, so a board shares every other pile with that one. Boards are
+    plain tuples of bytes, so they can go to other threads or processes
+    as they are.
+
+    >>> game = FreecellGame(number=1)
+    >>> before = game.board()
+    >>> game.move('aq')
+    True
+    >>> after = game.board()
+    >>> [a is b for a, b in zip(before.columns, after.columns)]
+    [False, True, True, True, True, True, True, True]
+    >>> Board.unpack(after.pack()) == after
+    True
+    """
+
+    __slots__ = ()
+
+    def pack(self):
+        """
+        Fixed-layout bytes encoding: four foundation rank counters, four
+        free cells, eight column lengths, then the column cards.
+        """
+        return self.foundation + self.cells \
+            + bytes(len(c) for c in self.columns) + b''.join(self.columns)
+
+    @classmethod
+    def unpack(cls, state):
+        columns = []
+        start = 16
+        for length in state[8:16]:
+            columns.append(bytes(state[start:start + length]))
+            start += length
+        return cls(bytes(state[:4]), bytes(state[4:8]), tuple(columns))
+
+
+# Zobrist keys for position hashes. The positional keys are per column or
+# cell slot, depth and card; the canonical keys leave out the slot so that
+# the order of columns and free cells does not matter.
+_zrandom = random.Random(52)
+ZOBRIST_MASK = 0xffffffffffffffff
+ZOBRIST_COLUMN = [[[_zrandom.getrandbits(64) for c in range(52)]
+                   for depth in range(53)] for slot in range(8)]
+ZOBRIST_CELL = [[_zrandom.getrandbits(64) for c in range(52)]
+                for slot in range(4)]
+ZOBRIST_FOUNDATION = [_zrandom.getrandbits(64) for c in range(52)]
+ZOBRIST_DEPTH = [[_zrandom.getrandbits(64) for c in range(52)]
+                 for depth in range(53)]
+ZOBRIST_FREECELL = [_zrandom.getrandbits(64) for c in range(52)]
+del _zrandom
+
+def zobrist_mix(key):
+    """splitmix64 finalizer, so column keys can be summed"""
+    key = (key ^ (key >> 30)) * 0xbf58476d1ce4e5b9 & ZOBRIST_MASK
+    key = (key ^ (key >> 27)) * 0x94d049bb133111eb & ZOBRIST_MASK
+    return key ^ (key >> 31)
+
+
 class FreecellGame(object):
     """
     >>> game = FreecellGame()
@@ -327,15 +671,72 @@ class FreecellGame(object):
     'Jack of Hearts'
     >>> game.columns[3].top_card().label
     'Eight of Clubs'
+    >>> FreecellGame(number=1).columns[7].cards
+    [5♡ , 3♡ , 3♣ , 7♠ , 7♢ , 10♣ ]
+
+    get_state() returns the packed state, and board() the same board as a
+    Board, which the undo history starts from. After that history holds
+    the moves made, see undo()
+    >>> state = game.get_state()
+    >>> len(state)
+    68
+    >>> game.move('ag')
+    True
+    >>> game.get_state() == state
+    False
+    >>> game.undo()
+    >>> game.get_state() == state
+    True
+    >>> game.set_state(game.__getstate__())
+    >>> game.get_state() == state
+    True
+
+    position_hash() is kept up to date as cards move
+    >>> game = FreecellGame(cards)
+    >>> key = game.position_hash()
+    >>> game.move('ag')
+    True
+    >>> game.position_hash() == key
+    False
+    >>> moved = game.position_hash(), game.position_hash(canonical=True)
+    >>> game.set_state(game.get_state())
+    >>> (game.position_hash(), game.position_hash(canonical=True)) == moved
+    True
+    >>> game.columns.reverse()
+    >>> game.set_state(game.__getstate__())
+    >>> game.position_hash() == moved[0]
+    False
+    >>> game.position_hash(canonical=True) == moved[1]
+    True
+    >>> game = FreecellGame(cards)
+    >>> game.move('ag')
+    True
+    >>> game.undo()
+    >>> game.position_hash() == key
+    True
     """
     mv_cols = list('asdfjkl;')
     mv_cells = list('qwertg')
     mv_found = list('uiopyh')
     mv_found_order = list('SHDC')
+    # move letters by slot, see _zobrist_add(), and the order legal_moves()
+    # lists the slots a card can go to
+    slot_letters = mv_cols + mv_cells[:4] + mv_found[:4]
+    legal_order = list(range(12, 16)) + list(range(8, 12)) + list(range(8))
+
+    # play safe cards to the foundations after every move
+    autoplay = False
 
+    # keep the board every this many replay entries, see resume()
+    CHECKPOINT_INTERVAL = 50
 
-    def __init__(self, deck=None):
-        if isinstance(deck, str):
+    # hints kept before they are cleared, see hint()
+    HINTS_KEPT = 10000
+
+    def __init__(self, deck=None, number=None):
+        if number:
+            self.deck = FreecellDeck(number)
+        elif isinstance(deck, str):
             self.deck = FreecellDeck()
             self.deck.loads(deck)
         elif isinstance(deck, FreecellDeck):
@@ -343,15 +744,19 @@ class FreecellGame(object):
         else:
             self.deck = FreecellDeck()
             self.deck.shuffle()
-        self.history = []
         self.replay = []
+        # {len(replay): packed board}, every CHECKPOINT_INTERVAL entries
+        self.checkpoints = {}
+        # replay entries skipped by resume(), played only if undone past
+        self.unplayed = 0
+        # position_hash(): next move, see hint()
+        self.hints = {}
         initial_state = {
             'columns': self.deck.deal(8),
             'foundation': {'S':[], 'H':[], 'D':[], 'C':[]},
             'freecells': [],
         }
         self.set_state(initial_state)
-        self.add_history()
 
     def complete(self):
         all_kings = True
@@ -361,7 +766,36 @@ class FreecellGame(object):
         return all_kings
 
     def get_state(self):
-        return self.__getstate__()
+        return self.pack_state()
+
+    def pack_state(self):
+        """the board as bytes, see Board.pack()"""
+        return self.board().pack()
+
+    def board(self):
+        """
+        The board as a Board. Only the piles that moved since the last
+        call are encoded again, see _zobrist_move() and column_occupied().
+        Changes made to the piles some other way need a set_state().
+        """
+        board, dirty = self._board, self._dirty
+        if board is None:
+            board, dirty = Board(None, None, (None,) * 8), 0xffff
+        if dirty:
+            foundation, cells, columns = board
+            columns = list(columns)
+            for slot, column in enumerate(self.columns):
+                if dirty >> slot & 1:
+                    columns[slot] = bytes(card.id + 1 for card in column.cards)
+            if dirty & 0xf00:
+                cells = bytes(card.id + 1 if card else 0
+                              for card in self.freecells.all_cards())
+            if dirty & 0xf000:
+                foundation = bytes(self.foundation[s].length
+                                   for s in self.mv_found_order)
+            board = self._board = Board(foundation, cells, tuple(columns))
+            self._dirty = 0
+        return board
 
     def __getstate__(self):
         foundation = {}
@@ -373,8 +807,71 @@ class FreecellGame(object):
             'freecells': self.freecells.all_cards()
         }
 
-    def set_state(self, state):
-        self.__setstate__(state)
+    def set_state(self, state, keys=None):
+        """
+        Puts the board in state, a Board, a packed state or a
+        __getstate__() dict, and starts the undo history over from there.
+        """
+        self._load(state, keys)
+        self.history = [self.board()]
+        self._pending = []
+
+    def _load(self, state, keys=None):
+        self._board = None
+        self._dirty = 0
+        # slots moved since legal_moves(), which starts over here
+        self._touched = 0xffff
+        self._legal = [0] * 16
+        self._legal_free = None
+        self._legal_list = []
+        # top card id by slot, -1 if empty, and the cards each column to
+        # column move needs to move, 0 if it can't go, by from * 8 + to
+        self._tops = [-1] * 16
+        self._need = [0] * 64
+        if isinstance(state, (Board, bytes)):
+            self.unpack_state(state)
+        else:
+            self.__setstate__(state)
+        # bit n is set while column n is empty
+        self.empty_columns = 0
+        for slot, column in enumerate(self.columns):
+            column.watch(self, slot)
+        # bit n is set while slot n has changed since board(), not counting
+        # the columns watch() just marked
+        self._dirty = 0
+        # the piles by slot, see _zobrist_add()
+        self._piles = self.columns + self.freecells.cells \
+            + [self.foundation[s] for s in self.mv_found_order]
+        if keys:
+            self._slots = {}
+            for slot, pile in enumerate(self._piles):
+                self._slots[id(pile)] = slot
+            (self.zobrist, column_keys, self._zcolumns, self._zcells,
+             self._zfoundation) = keys
+            self._column_keys = list(column_keys)
+        else:
+            self._rehash()
+
+    def unpack_state(self, state):
+        """sets up the piles from a Board or a packed state"""
+        if not isinstance(state, Board):
+            state = Board.unpack(state)
+        registry = FreecellCard.registry()
+        self.columns = []
+        self.freecells = Freecells()
+        self.foundation = {}
+        for i, s in enumerate(self.mv_found_order):
+            pile = FoundationPile(s)
+            pile.cards = list(registry[i*13:i*13 + state.foundation[i]])
+            self.foundation[s] = pile
+        for pos, c in enumerate(state.cells):
+            if c:
+                self.freecells.cells[pos].add_card(registry[c - 1])
+        for column in state.columns:
+            self.columns.append(
+                AltDescCardColumn([registry[c - 1] for c in column])
+            )
+        self._board = state
 
     def __setstate__(self, state):
         self.columns = []
@@ -393,30 +890,338 @@ class FreecellGame(object):
             if card:
                 self.freecells.add_card(card, pos)
 
-    def add_history(self):
-        self.history.append(self.get_state())
+    def add_history(self, join=False):
+        position = len(self.replay)
+        if join and len(self.history) > 1:
+            # part of the move before, see play_safe()
+            self.history[-1] += tuple(self._pending)
+            if self.checkpoints.pop(position - 1, None):
+                self.checkpoints[position] = self.get_state()
+        else:
+            self._seal()
+        self._pending = []
+        if position and not position % self.CHECKPOINT_INTERVAL:
+            self.checkpoints[position] = self.get_state()
+
+    def _seal(self):
+        """makes the moves since the last entry a history entry"""
+        if self.history:
+            self.history.append(tuple(self._pending))
+        else:
+            # undo() took back the first entry
+            self.history.append(self.board())
+        self._pending = []
+
+    def _set_apart(self):
+        """
+        Gives moves made with record=False since the last entry an entry
+        of their own, before a recorded move.
+        """
+        if self._pending:
+            self._seal()
+
+    def resume(self, replay, checkpoints=None):
+        """
+        Plays replay, a list of moves from the start of the game, to
+        continue a saved game. With checkpoints from an earlier game on
+        the same deck, it starts from the board at the last one and
+        plays only the moves after it. The moves before it are played
+        when something undoes back past the checkpoint, so the history
+        ends up the same as with game.move(replay).
+
+        >>> game = FreecellGame(number=1)
+        >>> game.CHECKPOINT_INTERVAL = 2
+        >>> game.move('aqswdefrzzzzzz')
+        True
+        >>> sorted(game.checkpoints)
+        [2, 4, 6]
+        >>> resumed = FreecellGame(number=1)
+        >>> resumed.resume(game.replay[:6], game.checkpoints)
+        True
+        >>> resumed.unplayed
+        6
+        >>> resumed.move('zz')
+        True
+        >>> resumed.unplayed
+        0
+        >>> resumed.history == game.history
+        True
+        >>> resumed.get_state() == game.get_state()
+        True
+        """
+        position = max(
+            [p for p in checkpoints or () if p <= len(replay)] or [0]
+        )
+        if position:
+            self._start = self.history[0]
+            self.replay = list(replay[:position])
+            self.checkpoints = dict(
+                (p, s) for p, s in checkpoints.items() if p <= position
+            )
+            self.set_state(checkpoints[position])
+            self.unplayed = position
+        autoplay, self.autoplay = self.autoplay, False
+        try:
+            return self.move(''.join(replay[position:]))
+        finally:
+            self.autoplay = autoplay
+
+    def _play_unplayed(self):
+        """replays the moves resume() skipped, under the current history"""
+        history = self.history[1:]
+        pending = self._pending
+        replay = self.replay
+        state, keys = self.board(), self._keys()
+        autoplay, self.autoplay = self.autoplay, False
+        self.set_state(self._start)
+        self.replay = []
+        self.move(''.join(replay[:self.unplayed]))
+        self.unplayed = 0
+        self.autoplay = autoplay
+        self.history.extend(history)
+        self.replay = replay
+        self._load(state, keys)
+        self._pending = pending
 
     def undo(self):
+        """
+        Takes back the last history entry, or the moves made since it if
+        there are any. history[0] is the packed board the game started
+        from, and each entry after it is a tuple of the moves that made
+        it, so undo moves those cards back instead of rebuilding the
+        board. A move is from_slot << 8 | to_slot << 4 | count, with the
+        slots numbered as in _zobrist_add().
+
+        >>> game = FreecellGame(number=1)
+        >>> game.move('aqsw')
+        True
+        >>> game.history[1:]
+        [(129,), (401,)]
+        >>> game.move('z')
+        True
+        >>> game.history[1:]
+        [(129,)]
+        >>> game.columns[1].length, game.freecells.free()
+        (7, 3)
+        """
+        if len(self.history) == 1 and self.unplayed:
+            self._play_unplayed()
         if len(self.history) == 1:
-            self.set_state(self.history[0])
+            self._revert_pending()
+            return
+        if self._pending:
+            self._revert_pending()
+        else:
+            for move in reversed(self.history.pop()):
+                self._unmove(move)
+        # like the board before the last entry, which the caller adds back
+        entry = self.history.pop()
+        self._pending = list(entry) if self.history else []
+
+    def _revert_pending(self, mark=0):
+        """takes back the moves made since the last history entry"""
+        pending = self._pending
+        while len(pending) > mark:
+            self._unmove(pending.pop())
+
+    def _unmove(self, move):
+        """moves the cards of a logged move back, without logging it"""
+        from_slot, to_slot, count = move >> 8, move >> 4 & 15, move & 15
+        source = self._piles[to_slot]
+        dest = self._piles[from_slot]
+        from_depth = source.length - count
+        to_depth = dest.length
+        if count == 1:
+            card = source.remove_top_card()
+            dest + card
+            cards = [card]
         else:
-            if self.get_state() == self.history[-1]:
-                self.history.pop()
-            self.set_state(self.history.pop())
+            stack = source.pop_stack(count)
+            dest + stack
+            cards = stack.cards
+        self._zobrist_move(cards, to_slot, from_slot, from_depth, to_depth)
+
+    def position_hash(self, canonical=False):
+        """
+        64-bit Zobrist hash of the position. The canonical hash is the same
+        for positions that only differ in the order of the columns or of
+        the free cells.
+        """
+        if canonical:
+            return self._zcolumns ^ self._zcells ^ self._zfoundation
+        return self.zobrist
+
+    def _keys(self):
+        return (self.zobrist, tuple(self._column_keys), self._zcolumns,
+                self._zcells, self._zfoundation)
+
+    def _rehash(self):
+        self._slots = {}
+        self.zobrist = 0
+        self._column_keys = [0] * 8
+        self._zcolumns = 0
+        self._zcells = 0
+        self._zfoundation = 0
+        for slot, column in enumerate(self.columns):
+            self._slots[id(column)] = slot
+            for depth, card in enumerate(column.cards):
+                self._zobrist_add(card, slot, depth)
+        for slot, cell in enumerate(self.freecells.cells, 8):
+            self._slots[id(cell)] = slot
+            for card in cell.cards:
+                self._zobrist_add(card, slot, 0)
+        for slot, s in enumerate(self.mv_found_order, 12):
+            self._slots[id(self.foundation[s])] = slot
+            for card in self.foundation[s].cards:
+                self._zobrist_add(card, slot, 0)
+
+    def _zobrist_add(self, card, slot, depth):
+        # adding and removing a card are the same xor
+        c = card.id
+        if slot < 8:
+            self.zobrist ^= ZOBRIST_COLUMN[slot][depth][c]
+            old = self._column_keys[slot]
+            new = old ^ ZOBRIST_DEPTH[depth][c]
+            self._column_keys[slot] = new
+            self._zcolumns = (self._zcolumns - zobrist_mix(old)
+                              + zobrist_mix(new)) & ZOBRIST_MASK
+        elif slot < 12:
+            self.zobrist ^= ZOBRIST_CELL[slot - 8][c]
+            self._zcells ^= ZOBRIST_FREECELL[c]
+        else:
+            self.zobrist ^= ZOBRIST_FOUNDATION[c]
+            self._zfoundation ^= ZOBRIST_FOUNDATION[c]
+
+    def _zobrist_move(self, cards, from_slot, to_slot, from_depth, to_depth):
+        self._dirty |= 1 << from_slot | 1 << to_slot
+        self._touched |= 1 << from_slot | 1 << to_slot
+        for n, card in enumerate(cards):
+            self._zobrist_add(card, from_slot, from_depth + n)
+            self._zobrist_add(card, to_slot, to_depth + n)
 
     def top_cards(self):
         return [c.top_card() for c in self.columns]
 
+    def legal_moves(self):
+        """
+        Every legal move as a two letter move string, worked out from the
+        board without trying the moves. Uses the letters for specific free
+        cells and foundations rather than 'g', 't', 'y' or 'h'.
+
+        The moves are kept between calls, as a mask of the slots each slot
+        can move to. Only the pairs with a pile that moved since the last
+        call are checked again, and the column to column moves of more
+        than one card if the number of free cells and empty columns
+        changed.
+
+        >>> game = FreecellGame(number=1)
+        >>> game.legal_moves()[:6]
+        ['aq', 'aw', 'ae', 'ar', 'sq', 'sw']
+        >>> game.move(';q')
+        True
+        >>> [m for m in game.legal_moves() if not m[1] in 'qwer']
+        ['a;', 'j;', ';l']
+        """
+        free = self.freecell_count()
+        touched = self._touched
+        if not touched and free == self._legal_free:
+            return list(self._legal_list)
+        legal, need, tops = self._legal, self._need, self._tops
+        moved = [s for s in range(16) if touched >> s & 1]
+        for s in moved:
+            top = self._piles[s].top_card()
+            tops[s] = top.id if top else -1
+        for fr in range(16):
+            if touched >> fr & 1:
+                targets = range(16)
+                if fr < 8:
+                    need[fr * 8:fr * 8 + 8] = [0] * 8
+            elif tops[fr] < 0:
+                continue
+            else:
+                targets = moved
+            for to in targets:
+                if self._legal_pair(fr, to, free):
+                    legal[fr] |= 1 << to
+                else:
+                    legal[fr] &= ~(1 << to)
+        if free != self._legal_free:
+            # the columns to column moves that need more free cells
+            for fr in range(8):
+                for to in range(8):
+                    n = need[fr * 8 + to]
+                    if n > 1 and not touched >> fr & 1 \
+                            and not touched >> to & 1:
+                        if n <= free + 1:
+                            legal[fr] |= 1 << to
+                        else:
+                            legal[fr] &= ~(1 << to)
+        self._touched = 0
+        self._legal_free = free
+        moves = []
+        for fr, targets in enumerate(legal):
+            if targets:
+                for to in self.legal_order:
+                    if targets >> to & 1:
+                        moves.append(self.slot_letters[fr]
+                                     + self.slot_letters[to])
+        self._legal_list = moves
+        return list(moves)
+
+    def _legal_pair(self, fr, to, free):
+        """
+        Whether the top of slot fr can move to slot to, with free free
+        cells and empty columns. Keeps the number of cards a column to
+        column move needs in _need, for when free changes.
+        """
+        card = self._tops[fr]
+        if card < 0 or fr == to:
+            return False
+        if to >= 12:
+            return fr < 12 and card == (to - 12) * 13 \
+                + len(self._piles[to].cards)
+        onto = self._tops[to]
+        if to >= 8:
+            return onto < 0
+        if fr >= 8:
+            return onto < 0 or FITS[card][onto]
+        if onto < 0:
+            count = 1
+        else:
+            count = onto % 13 - card % 13
+            column = self._piles[fr]
+            if not 1 <= count <= column.run_length() \
+                    or not FITS[column.cards[-count].id][onto]:
+                count = 0
+        self._need[fr * 8 + to] = count
+        return 0 < count <= free + 1
+
+    def completions(self, text=''):
+        """
+        The legal moves that start with text, for tab completion. Only the
+        first move is completed, since the moves after it depend on the
+        board it leaves.
+
+        >>> game = FreecellGame(number=1)
+        >>> game.completions(';')
+        [';q', ';w', ';e', ';r']
+        >>> game.completions(';q')
+        [';q']
+        >>> game.completions(';q;')
+        []
+        """
+        if len(text) > 2:
+            return []
+        return [m for m in self.legal_moves() if m.startswith(text)]
+
     def parse_moves(self, moves):
         movelist = []
         if moves in ['z', 'zz']:
             movelist.append(('z','z'))
         elif moves in ['m', 'mm']:
-            self.move_all_to_foundation()
+            movelist.append(('m','m'))
         else:
-            moves = list(moves)
-            while len(moves) >= 2:
-                movelist.append((moves.pop(0), moves.pop(0)))
+            movelist = list(zip(moves[::2], moves[1::2]))
         return movelist
 
     def move(self, moves):
@@ -424,6 +1229,14 @@ class FreecellGame(object):
 
         for fr, to in movelist:
             card = None
+            self._set_apart()
+
+            if fr == to and fr == 'h':
+                self.play_safe()
+                continue
+            if fr == to and fr in 'my':
+                self.move_all_to_foundation(safe=fr == 'y')
+                continue
 
             if fr in self.mv_cols:
                 move_from = self.columns[self.mv_cols.index(fr)]
@@ -479,19 +1292,164 @@ class FreecellGame(object):
             if success:
                 self.replay.append('{}{}'.format(fr, to))
                 self.add_history()
+                if self.autoplay and to != 'z':
+                    self.play_safe()
             else:
-                self.set_state(self.history[-1])
+                self._revert_pending()
+                if STATS.enabled:
+                    with STATS.lock:
+                        STATS.rollbacks += 1
                 return False
 
         return True
 
+    def apply(self, move, record=True):
+        """
+        Headless version of move() for a single parsed move, a (from, to)
+        pair of move letters. Returns one of the MOVE_ codes instead of
+        printing errors, and leaves the board alone when the move fails.
+        With record=False the move is not added to history or replay.
+
+        >>> game = FreecellGame(number=1)
+        >>> game.apply(('a', 'q'))
+        0
+        >>> game.apply(('s', 'q')) == MOVE_ILLEGAL
+        True
+        >>> game.apply(('w', 'a')) == MOVE_EMPTY
+        True
+        >>> game.apply(('x', 'a')) == MOVE_UNKNOWN
+        True
+        >>> game.apply(('z', 'z'))
+        0
+        >>> game.replay
+        ['aq', 'zz']
+
+        Moves made with record=False are kept apart from recorded ones, so
+        a failed move or an undo only takes back its own
+        >>> game = FreecellGame(number=1)
+        >>> game.move('aqsw')
+        True
+        >>> game.apply(('z', 'z'), record=False)
+        0
+        >>> len(game.history), game.freecells.free()
+        (2, 3)
+        >>> game.apply(('d', 'e'), record=False)
+        0
+        >>> import contextlib, io
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     moved = game.move('sq')
+        >>> moved, game.columns[2].length
+        (False, 6)
+        >>> game.move('fr')
+        True
+        >>> game.move('z')
+        True
+        >>> game.columns[2].length, game.columns[3].length
+        (6, 7)
+        """
+        fr, to = move
+        if record:
+            self._set_apart()
+        if fr == to and fr == 'h':
+            self.play_safe(record)
+            return MOVE_OK
+        if fr == to and fr in 'my':
+            self.move_all_to_foundation(fr == 'y', record)
+            return MOVE_OK
+        if fr == 'z' or to == 'z':
+            self.undo()
+            if not record:
+                # put back the entry undo() left for add_history()
+                self._seal()
+        else:
+            status = self._apply(fr, to)
+            if status != MOVE_OK:
+                return status
+        if record:
+            self.replay.append(fr + to)
+            self.add_history()
+        if self.autoplay and fr != 'z' and to != 'z':
+            self.play_safe(record)
+        return MOVE_OK
+
+    def _apply(self, fr, to):
+        if fr in self.mv_cols:
+            move_from = self.columns[self.mv_cols.index(fr)]
+        elif fr in self.mv_cells[:4]:
+            move_from = self.freecells.cells[self.mv_cells.index(fr)]
+        elif fr in self.mv_found[:4]:
+            key = self.mv_found_order[self.mv_found.index(fr)]
+            move_from = self.foundation[key]
+        else:
+            return MOVE_UNKNOWN
+        card = move_from.top_card()
+
+        if to in self.mv_cols:
+            move_to = self.columns[self.mv_cols.index(to)]
+            if fr in self.mv_cols:
+                if not card:
+                    return MOVE_EMPTY
+                if not self.stack_count(move_from, move_to):
+                    return MOVE_ILLEGAL
+                self.move_stack(move_from, move_to)
+                return MOVE_OK
+            elif card and not move_to.allow_card(card):
+                return MOVE_ILLEGAL
+        elif to in self.mv_cells:
+            if to in 'tg':
+                if not self.freecells.free():
+                    return MOVE_ILLEGAL
+                index = self.freecells.first_open()
+            else:
+                index = self.mv_cells.index(to)
+            move_to = self.freecells.cells[index]
+            if move_to.length:
+                return MOVE_ILLEGAL
+        elif to in self.mv_found:
+            if to in 'yh':
+                if not card:
+                    return MOVE_EMPTY
+                key = card.suit.c
+            else:
+                key = self.mv_found_order[self.mv_found.index(to)]
+            move_to = self.foundation[key]
+            if card and move_to.next_card() != card:
+                return MOVE_ILLEGAL
+        else:
+            return MOVE_UNKNOWN
+
+        if not card:
+            return MOVE_EMPTY
+        if move_to is move_from:
+            return MOVE_ILLEGAL
+        self.move_card(card, move_from, move_to)
+        return MOVE_OK
+
+    def stack_count(self, move_from, move_to):
+        """
+        How many cards move_stack would move from one column to another,
+        or 0 if it is not a legal move.
+        """
+        if not move_from.cards or move_from is move_to:
+            return 0
+        onto = move_to.top_card()
+        if not onto:
+            return min(move_from.run_length(), self.freecell_count())
+        count = move_from.count_for(onto)
+        if count > self.freecell_count() + 1:
+            return 0
+        return count
+
     def move_card(self, card, move_from, move_to):
+        from_depth = move_from.length - 1
+        to_depth = move_to.length
         try:
             move_to.add_card(card)
         except:
             raise
         else:
             move_from.remove_top_card()
+            self._log_move([card], move_from, move_to, from_depth, to_depth)
             return True
 
     def move_stack(self, move_from, move_to):
@@ -511,6 +1469,8 @@ class FreecellGame(object):
             )
 
         if stack.length <= self.freecell_count()+1:
+            from_depth = move_from.length - stack.length
+            to_depth = move_to.length
             try:
                 move_to.add_stack(stack)
             except InvalidColumnStackError:
@@ -518,39 +1478,192 @@ class FreecellGame(object):
                     "Can't move stack '{}' to {}".format(stack, onto_card)
                 )
             else:
-                if onto_card:
-                    move_from.remove_top_stack_for(onto_card)
-                else:
-                    move_from.remove_top_stack(length)
+                move_from.pop_stack(stack.length)
+                self._log_move(stack.cards, move_from, move_to,
+                               from_depth, to_depth)
                 return True
         else:
             raise FreecellInvalidMoveError(
                 "Not enough freecells to move stack '{}'".format(stack)
             )
 
-    def move_all_to_foundation(self):
-        def recurse():
-            next_on_founds = [f.next_card() for f in self.foundation.values()]
-            for i, card in enumerate(self.top_cards()):
-                if card and card in next_on_founds:
-                    self.move('{}y'.format(self.mv_cols[i]))
-                    return True
-            for i, card in enumerate(self.freecells.all_cards()):
-                if card and card in next_on_founds:
-                    self.move('{}y'.format(self.mv_cells[i]))
-                    return True
-        while recurse():
-            recurse()
+    def _log_move(self, cards, move_from, move_to, from_depth, to_depth):
+        """hashes cards moved between piles and logs the move for undo()"""
+        from_slot = self._slots[id(move_from)]
+        to_slot = self._slots[id(move_to)]
+        self._zobrist_move(cards, from_slot, to_slot, from_depth, to_depth)
+        self._pending.append(from_slot << 8 | to_slot << 4 | len(cards))
+
+    def move_all_to_foundation(self, safe=False, record=True):
+        """
+        Plays every card it can to the foundations, or with safe=True only
+        the ones that are safe to play. All of them together make one
+        history entry, recorded in the replay as 'mm', or 'yy' for safe
+        moves. Returns the moves made.
+
+        >>> game = FreecellGame(number=14)
+        >>> game.move('kq')
+        True
+        >>> game.move_all_to_foundation(safe=True)
+        ['ko', ';p', 'so']
+        >>> game.replay
+        ['kq', 'yy']
+        >>> game.undo()
+        >>> game.foundation['D'].length
+        0
+        """
+        if record:
+            self._set_apart()
+        moves = self.promote(safe)
+        if moves and record:
+            self.replay.append('yy' if safe else 'mm')
+            self.add_history()
+        return moves
+
+    def play_safe(self, record=True):
+        """
+        What autoplay does after each move: plays the cards that are safe
+        to play to the foundations, as part of the move's history entry so
+        that one undo takes back both. Recorded in the replay as 'hh'.
+
+        >>> game = FreecellGame(number=14)
+        >>> game.autoplay = True
+        >>> game.move('kq')
+        True
+        >>> game.foundation['D'].length
+        2
+        >>> game.replay
+        ['kq', 'hh']
+        >>> game.move('z')
+        True
+        >>> game.foundation['D'].length, game.freecells.free()
+        (0, 4)
+        """
+        if record:
+            self._set_apart()
+        moves = self.promote(True)
+        if moves and record:
+            self.replay.append('hh')
+            self.add_history(join=True)
+        return moves
+
+    def promote(self, safe=False):
+        """
+        Moves cards from the columns and free cells to the foundations
+        until none of the exposed cards can go, and returns the moves. It
+        keeps the next rank each foundation needs, so each card played
+        costs a pass over the twelve exposed cards.
+        """
+        founds = [self.foundation[s] for s in self.mv_found_order]
+        needed = [f.length for f in founds]
+        sources = list(zip(self.mv_cols, self.columns)) \
+            + list(zip(self.mv_cells, self.freecells.cells))
+        moves = []
+        played = True
+        while played:
+            played = False
+            for letter, pile in sources:
+                card = pile.top_card()
+                while card and card.rank.id == needed[card.suit.id] \
+                        and (not safe or safe_to_foundation(card.id, needed)):
+                    suit = card.suit.id
+                    self.move_card(card, pile, founds[suit])
+                    needed[suit] += 1
+                    moves.append(letter + self.mv_found[suit])
+                    played = True
+                    card = pile.top_card()
+        return moves
+
+    def solve(self, **kwargs):
+        """
+        Returns a move string that solves the game from the current
+        position, or None. Options are passed on to solver.Solver.
+        """
+        from solver import solve
+        return solve(self, **kwargs)
+
+    def hint(self, budget_ms=100):
+        """
+        A next move, worked out in about budget_ms milliseconds, or None
+        if there are no moves. It is the first move of a solution if the
+        solver finds one in time, or else of the way to the best position
+        it reached. Hints are kept by position_hash(), along with one for
+        each position on the way, so asking again, after an undo or after
+        playing the hint is instant. They are cleared once there are more
+        than HINTS_KEPT.
+
+        >>> game = FreecellGame(number=1)
+        >>> move = game.hint()
+        >>> move in game.legal_moves()
+        True
+        >>> game.move(move)
+        True
+        >>> game.position_hash() in game.hints
+        True
+        """
+        key = self.position_hash()
+        if key in self.hints:
+            return self.hints[key]
+        if len(self.hints) > self.HINTS_KEPT:
+            self.hints.clear()
+        began = time.time()
+        from solver import Solver
+        # leave some of the budget for learn()
+        solver = Solver(
+            self, max_seconds=budget_ms * 0.0008 - (time.time() - began)
+        )
+        moves = solver.solve() or solver.partial
+        if moves:
+            self.learn(moves)
+        else:
+            legal = self.legal_moves()
+            self.hints[key] = legal[0] if legal else None
+        return self.hints[key]
+
+    def learn(self, moves):
+        """
+        Plays moves without recording them and keeps each one as the hint
+        for the position it was played from, then puts the board back.
+        """
+        mark = len(self._pending)
+        autoplay, self.autoplay = self.autoplay, False
+        for move in self.parse_moves(moves):
+            key = self.position_hash()
+            if self.apply(move, record=False) != MOVE_OK:
+                break
+            self.hints[key] = ''.join(move)
+        self.autoplay = autoplay
+        self._revert_pending(mark)
+
+    def column_occupied(self, slot, occupied):
+        self._dirty |= 1 << slot
+        self._touched |= 1 << slot
+        if occupied:
+            self.empty_columns &= ~(1 << slot)
+        else:
+            self.empty_columns |= 1 << slot
 
     def freecell_count(self):
-        return self.freecells.free() + self.top_cards().count(None)
+        return self.freecells.free() + BIT_COUNT[self.empty_columns]
 
     def draw_board(self, cardwidth=8, suit_offset=2):
+        return '\n'.join(
+            ''.join(row) for row in self.board_cells(cardwidth, suit_offset)
+        )
+
+    def board_cells(self, cardwidth=8, suit_offset=2, draw=None):
+        """
+        The board as rows of eight cells, each cell the text for one
+        card or gap including the space after it. draw is called with a
+        card to get its cell, card.draw(cardwidth) by default.
+        """
         # the suit symbols take up less than one character, so the offset
         # is how much you have to subtract from the width in spots that
         # do not have a suit character
         if cardwidth - suit_offset < 5:
             cardwidth = 5 + suit_offset
+        if draw is None:
+            draw = lambda card: card.draw(cardwidth) + " "
 
         longest_column = max([c.length for c in self.columns])
 
@@ -559,52 +1672,129 @@ class FreecellGame(object):
         found = "{}" + "_"*(cardwidth - suit_offset - 1) + " "
         movel = "%".center(cardwidth - suit_offset) + " "
 
-        board = ''
-
         # empty space before foundations
-        board = space*4
+        row = [space]*4
         # foundations
         for s in ['S','H','D','C']:
             f = self.foundation[s]
             if f.length == 0:
-                board = board + found.format(f.suit.symbol)
+                row.append(found.format(f.suit.symbol))
             else:
-                board = board + f.top_card().draw(cardwidth) + " "
+                row.append(draw(f.top_card()))
+        rows = [row]
 
-        board = board + "\n"
-
-        # free cell move hints
-        for l in self.mv_cells[:4]:
-            board = board + movel.replace('%',l)
-        # foundation move hints
-        for l in self.mv_found[:4]:
-            board = board + movel.replace('%',l)
-
-        board = board + "\n"
+        # free cell and foundation move hints
+        rows.append([movel.replace('%',l)
+                     for l in self.mv_cells[:4] + self.mv_found[:4]])
 
         # freecells
+        row = []
         for c in self.freecells.cells:
             if c.length == 0:
-                board = board + blank
+                row.append(blank)
             else:
-                board = board + c.top_card().draw(cardwidth) + " "
+                row.append(draw(c.top_card()))
         # empty space after freecells
-        board = board + space*4
+        rows.append(row + [space]*4)
 
-        board = board + "\n" + space*8
+        rows.append([space]*8)
 
         # rows
         for n in range(0, longest_column+2):
-            board = board + "\n"
+            row = []
             for letter, c in zip(self.mv_cols, self.columns):
                 card = c.card_at(n)
                 if card:
-                    board = board + card.draw(cardwidth) + " "
+                    row.append(draw(card))
                 elif n == c.length + 1:
-                    board = board + movel.replace('%',letter)
+                    row.append(movel.replace('%',letter))
                 else:
-                    board = board + space
-        return board
+                    row.append(space)
+            rows.append(row)
+        return rows
+
+
+class BoardRenderer(object):
+    """
+    Draws a FreecellGame to the terminal with ANSI cursor addressing,
+    writing only the cells that changed since the last frame. The first
+    frame, and the first one after invalidate(), clears the screen and
+    draws everything. Call invalidate() after printing anything else, as
+    that moves the board. Each card's cell is drawn once and kept.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> renderer = BoardRenderer(8, 2, out)
+    >>> game = FreecellGame(number=1)
+    >>> renderer.render(game)
+    >>> out.getvalue().startswith(renderer.CLEAR)
+    True
+    >>> frame = out.getvalue()
+    >>> game.move('aq')
+    True
+    >>> renderer.render(game)
+    >>> changed = out.getvalue()[len(frame):]
+    >>> changed.count('\033[') < frame.count('\033[') // 4
+    True
+    >>> renderer.render(game)
+    >>> out.getvalue()[len(frame) + len(changed):] == renderer.END.format(
+    ...     len(renderer.frame) + 1)
+    True
+    """
+
+    CLEAR = '\033[H\033[2J'
+    GOTO = '\033[{};{}H'
+    END = '\033[{};1H\033[J'
+    ERASE_LINE = '\033[K'
+
+    def __init__(self, cardwidth=8, suit_offset=2, out=None, rule='--------'):
+        if cardwidth - suit_offset < 5:
+            cardwidth = 5 + suit_offset
+        self.cardwidth = cardwidth
+        self.suit_offset = suit_offset
+        self.cell_width = cardwidth - suit_offset + 1
+        self.out = out
+        self.rule = rule
+        self.cards = {}
+        self.frame = None
+
+    def draw(self, card):
+        try:
+            return self.cards[card.id]
+        except KeyError:
+            cell = self.cards[card.id] = card.draw(self.cardwidth) + " "
+            return cell
+
+    def invalidate(self):
+        self.frame = None
+
+    def render(self, game):
+        frame = [[self.rule]] \
+            + game.board_cells(self.cardwidth, self.suit_offset, self.draw) \
+            + [[self.rule]]
+        if self.frame is None:
+            text = [self.CLEAR]
+            last = []
+        else:
+            text = []
+            last = self.frame
+        for y, row in enumerate(frame):
+            old = last[y] if y < len(last) else None
+            if old is None or len(old) != len(row):
+                text.append(self.GOTO.format(y + 1, 1))
+                text.extend(row)
+                text.append(self.ERASE_LINE)
+                continue
+            for x, cell in enumerate(row):
+                if cell != old[x]:
+                    text.append(self.GOTO.format(y + 1, x*self.cell_width + 1))
+                    text.append(cell)
+        # leave the cursor under the board, clearing whatever was there
+        text.append(self.END.format(len(frame) + 1))
+        self.frame = frame
+        out = self.out or sys.stdout
+        out.write(''.join(text))
+        out.flush()
 
 
 class GameHistory(object):
@@ -629,10 +1819,32 @@ class GameHistory(object):
     >>> record = gh.get(3)
     >>> record[0][gh.I_DECK] == str(game.deck)
     True
+    >>> gh.add_grades([{'deck': 'blah', 'dealnum': 1, 'solvable': 1,
+    ...     'length': 90, 'nodes': 812, 'seconds': 0.4, 'solution': 'ay'}])
+    >>> gh.get_grade('blah')[1:4]
+    (1, 1, 90)
+    >>> gh.add({'deck': FreecellDeck(number=1).dumps(), 'time': 5, 'moves': 0,
+    ...     'replay': '', 'complete': 0})
+    4
+    >>> gh.get(4)[0][gh.I_DECK] == FreecellDeck(number=1).__repr__()
+    True
+    >>> gh.add_grades([{'deck': FreecellDeck(number=2).dumps(), 'dealnum': 2,
+    ...     'solvable': 1, 'length': 80, 'nodes': 500, 'seconds': 0.3,
+    ...     'solution': 'aq'}])
+    >>> gh.get_grade(FreecellDeck(number=2).dumps())[1:4]
+    (2, 1, 80)
+    >>> gh.get_grade(FreecellDeck(number=2).__repr__())[1:4]
+    (2, 1, 80)
 
     clean up
     >>> gh.conn.execute("drop table gamehistory") and True
     True
+    >>> gh.conn.execute("drop table dealgrades") and True
+    True
+    >>> gh.conn.execute("drop table checkpoints") and True
+    True
+    >>> gh.conn.execute("drop table packedreplays") and True
+    True
     >>> gh.conn.commit()
     >>> gh.conn.close()
     """
@@ -644,9 +1856,18 @@ class GameHistory(object):
     I_REPLAY = 5
     I_COMPL = 6
 
+    # seconds to wait for another connection's write lock
+    BUSY_TIMEOUT = 10
+
+    # columns written by export_games() and read by import_games()
+    EXPORT_COLUMNS = ['datetime', 'deck', 'time', 'moves', 'replay', 'complete']
+
     def __init__(self, db):
         db = os.path.expanduser(db)
-        self.conn = sqlite3.connect(db)
+        self.conn = sqlite3.connect(db, timeout=self.BUSY_TIMEOUT)
+        # readers don't block the writer, so several REPL sessions and
+        # --grade runs can share one file
+        self.conn.execute("pragma journal_mode=wal")
         self.conn.execute("""
             create table if not exists gamehistory(
                 id integer primary key,
@@ -658,54 +1879,276 @@ class GameHistory(object):
                 complete integer
             )
         """)
+        # boards every FreecellGame.CHECKPOINT_INTERVAL moves of saved
+        # games, and their replays packed with pack_replay(), for resume()
+        self.conn.execute("""
+            create table if not exists checkpoints(
+                gameid integer,
+                position integer,
+                state blob,
+                primary key (gameid, position)
+            )
+        """)
+        self.conn.execute("""
+            create table if not exists packedreplays(
+                gameid integer primary key,
+                replay blob
+            )
+        """)
+        # leaderboards and unfinished() read these in order instead of
+        # scanning and sorting the table
+        self.conn.execute("""
+            create index if not exists gamehistory_times
+            on gamehistory(complete, time, moves)
+        """)
+        self.conn.execute("""
+            create index if not exists gamehistory_moves
+            on gamehistory(complete, moves, time)
+        """)
+        self.conn.execute("""
+            create table if not exists dealgrades(
+                deck text primary key,
+                dealnum integer,
+                solvable integer,
+                length integer,
+                nodes integer,
+                seconds real,
+                solution text,
+                datetime text
+            )
+        """)
         self.conn.commit()
 
+    @staticmethod
+    def deck_text(deck):
+        """
+        deck in the text format, which is how it is stored, if it is a
+        full deck in the one letter per card format.
+        """
+        if len(deck) == 52 and is_compact(deck):
+            cards = FreecellDeck()
+            cards.loads(deck)
+            return cards.__repr__()
+        return deck
+
     def add(self, values):
+        values = dict(values, deck=self.deck_text(values['deck']))
         gameid = values.get('gameid', None)
         exists = gameid and self.get(values['gameid'])
         if exists:
             query = """
             update gamehistory
-            set time={time}, moves={moves}, replay='{replay}', complete={complete}
-            where id={gameid}
-            """.format(**values)
+            set time=:time, moves=:moves, replay=:replay, complete=:complete
+            where id=:gameid
+            """
         else:
             query = """
             insert into gamehistory
             (datetime, deck, time, moves, replay, complete) values
-            (datetime('now'), '{deck}', {time}, {moves}, '{replay}', {complete})
-            """.format(**values)
-        cursor = self.conn.execute(query)
+            (datetime('now'), :deck, :time, :moves, :replay, :complete)
+            """
+        cursor = self.conn.execute(query, values)
         self.conn.commit()
         return gameid or cursor.lastrowid
 
+    def add_many(self, games, batch_size=1000):
+        """
+        Inserts games from an iterable of dicts with the keys in
+        EXPORT_COLUMNS, committing once per batch_size rows. datetime may
+        be left out or None for now. Returns the number of rows added.
+        """
+        query = """
+            insert into gamehistory
+            (datetime, deck, time, moves, replay, complete) values
+            (coalesce(:datetime, datetime('now')), :deck, :time, :moves,
+             :replay, :complete)
+        """
+        rows = (dict(g, datetime=g.get('datetime'),
+                     deck=self.deck_text(g['deck'])) for g in games)
+        count = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            self.conn.executemany(query, batch)
+            self.conn.commit()
+            count += len(batch)
+        return count
+
+    def export_games(self, out, fmt='jsonl'):
+        """
+        Writes every game to the file out as JSON lines or, with
+        fmt='csv', as CSV with a header row. Times are UTC as stored.
+        Returns the number of games written.
+
+        >>> import io
+        >>> gh = GameHistory(':memory:')
+        >>> gh.add_many([{'deck': 'AS,2S', 'time': 60, 'moves': 2,
+        ...     'replay': 'ay', 'complete': 1}] * 3, batch_size=2)
+        3
+        >>> out = io.StringIO()
+        >>> gh.export_games(out, 'csv')
+        3
+        >>> out.getvalue().splitlines()[1][19:]
+        ',"AS,2S",60,2,ay,1'
+        >>> other = GameHistory(':memory:')
+        >>> other.import_games(io.StringIO(out.getvalue()), 'csv')
+        3
+        >>> out = io.StringIO()
+        >>> other.export_games(out)
+        3
+        >>> other.import_games(io.StringIO(out.getvalue()))
+        3
+        >>> [r[gh.I_MOVES] for r in other.iter_select('where complete=?', (1,))]
+        [2, 2, 2, 2, 2, 2]
+        """
+        rows = self._iter(
+            "select {} from gamehistory order by id".format(
+                ', '.join(self.EXPORT_COLUMNS)
+            )
+        )
+        count = 0
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(self.EXPORT_COLUMNS)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                out.write(json.dumps(dict(zip(self.EXPORT_COLUMNS, row))))
+                out.write('\n')
+                count += 1
+        return count
+
+    def import_games(self, infile, fmt='jsonl', batch_size=1000):
+        """
+        Adds the games in a file written by export_games(), reading it a
+        line at a time. Games get new ids. Returns the number added.
+        """
+        if fmt == 'csv':
+            games = (
+                dict(row, time=int(row['time']), moves=int(row['moves']),
+                     complete=int(row['complete']),
+                     datetime=row['datetime'] or None)
+                for row in csv.DictReader(infile)
+            )
+        else:
+            games = (json.loads(line) for line in infile if line.strip())
+        return self.add_many(games, batch_size)
+
     def get(self, gameid):
-        return self.select("where id={}".format(gameid))
+        return self.select("where id=?", (gameid,))
 
     def remove(self, gameid):
-        query = "delete from gamehistory where id={}".format(gameid)
-        self.conn.execute(query)
+        self.conn.execute("delete from gamehistory where id=?", (gameid,))
+        self.conn.execute("delete from checkpoints where gameid=?", (gameid,))
+        self.conn.execute("delete from packedreplays where gameid=?", (gameid,))
         self.conn.commit()
 
     def save(self, game, time=None, gameid=None):
+        return self.save_record(self.record(game, time, gameid))
+
+    @staticmethod
+    def record(game, time=None, gameid=None):
+        """what save() writes for game, taken now to be written later"""
         game.deck.reset()
-        return self.add({
+        return {
             'gameid': gameid or 0,
             'deck': game.deck.__repr__(),
-            'time': int(time) or 0,
+            'time': int(time or 0),
             'moves': len(game.replay),
             'replay': ''.join(game.replay),
             'complete': 1 if game.complete() else 0,
-        })
+            'packed': pack_replay(game.replay),
+            'checkpoints': dict(game.checkpoints),
+        }
+
+    def save_record(self, record):
+        gameid = self.add(record)
+        self.conn.execute("delete from checkpoints where gameid=?", (gameid,))
+        self.conn.executemany(
+            "insert into checkpoints (gameid, position, state) values (?, ?, ?)",
+            [(gameid, p, s) for p, s in record['checkpoints'].items()]
+        )
+        self.conn.execute(
+            "insert or replace into packedreplays (gameid, replay) values (?, ?)",
+            (gameid, record['packed'])
+        )
+        self.conn.commit()
+        return gameid
+
+    def resume(self, gameid):
+        """
+        The saved game gameid with its moves played, starting from its
+        last checkpoint, or None if there is no such game.
+
+        >>> gh = GameHistory(':memory:')
+        >>> game = FreecellGame(number=1)
+        >>> game.move('aqzz' * 26)
+        True
+        >>> gh.save(game, 10)
+        1
+        >>> resumed = gh.resume(1)
+        >>> resumed.unplayed
+        50
+        >>> resumed.get_state() == game.get_state()
+        True
+        """
+        record = self.get(gameid)
+        if not record:
+            return None
+        game = FreecellGame(record[0][self.I_DECK])
+        c = self.conn.execute(
+            "select replay from packedreplays where gameid=?", (gameid,)
+        )
+        packed = c.fetchone()
+        c.close()
+        if packed:
+            replay = unpack_replay(packed[0])
+        else:
+            text = record[0][self.I_REPLAY]
+            replay = [text[i:i + 2] for i in range(0, len(text), 2)]
+        c = self.conn.execute(
+            "select position, state from checkpoints where gameid=?", (gameid,)
+        )
+        checkpoints = dict(c.fetchall())
+        c.close()
+        game.resume(replay, checkpoints)
+        return game
+
+    def add_grades(self, grades):
+        """
+        Stores solver results for a batch of deals in one transaction.
+        solvable is 1 or 0, or None when the solver hit a limit.
+        """
+        grades = (dict(g, deck=self.deck_text(g['deck'])) for g in grades)
+        self.conn.executemany("""
+            insert or replace into dealgrades
+            (deck, dealnum, solvable, length, nodes, seconds, solution,
+             datetime) values
+            (:deck, :dealnum, :solvable, :length, :nodes, :seconds,
+             :solution, datetime('now'))
+        """, grades)
+        self.conn.commit()
+
+    def get_grade(self, deck):
+        c = self.conn.execute(
+            "select deck, dealnum, solvable, length, nodes, seconds, solution "
+            "from dealgrades where deck=?", (self.deck_text(deck),)
+        )
+        result = c.fetchone()
+        c.close()
+        return result
 
     def besttimes(self, count=10):
         return self.select(
-            "where complete=1 order by time asc, moves asc limit {}".format(count)
+            "where complete=1 order by time asc, moves asc limit ?", (int(count),)
         )
 
     def leastmoves(self, count=10):
         return self.select(
-            "where complete=1 order by moves asc, time asc limit {}".format(count)
+            "where complete=1 order by moves asc, time asc limit ?", (int(count),)
         )
 
     def unfinished(self):
@@ -747,15 +2190,305 @@ class GameHistory(object):
         table.append(border)
         print('\n'.join(table))
 
-    def select(self, query):
+    def select(self, query, params=()):
         c = self.conn.execute(
             "select id, datetime(datetime, 'localtime'), deck, time, moves, "
-            "replay, complete from gamehistory {}".format(query)
+            "replay, complete from gamehistory {}".format(query), params
         )
         result = c.fetchall()
         c.close()
         return result
 
+    def iter_select(self, query='', params=(), size=500):
+        """
+        Like select() but yields the rows, fetching size at a time
+        rather than the whole result.
+        """
+        return self._iter(
+            "select id, datetime(datetime, 'localtime'), deck, time, moves, "
+            "replay, complete from gamehistory {}".format(query), params, size
+        )
+
+    def _iter(self, sql, params=(), size=500):
+        c = self.conn.execute(sql, params)
+        try:
+            while True:
+                rows = c.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            c.close()
+
+
+class HistoryWriter(threading.Thread):
+    """
+    Saves games from a thread with its own GameHistory connection, so
+    the caller never waits on the database. save() takes what it needs
+    from the game straight away and returns a Future for the game id.
+    Autosaves are held for up to interval seconds, and only the latest
+    one for each game is written. Anything else queued, and close(),
+    writes whatever is held first.
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> writer = HistoryWriter(os.path.join(tmp.name, 'games.db'), interval=60)
+    >>> game = FreecellGame(number=1)
+    >>> game.move('aq')
+    True
+    >>> autosave = writer.save(game, 5, autosave=True)
+    >>> game.move('sw')
+    True
+    >>> autosave = writer.save(game, 9, autosave=True)
+    >>> autosave.done()
+    False
+    >>> writer.save(game, 12).result()
+    1
+    >>> autosave.result()
+    1
+    >>> writer.call(lambda history: history.get(1)[0][history.I_MOVES]).result()
+    2
+    >>> gameid, besttimes, leastmoves = writer.leaderboards(
+    ...     writer.save(game, 12)).result()
+    >>> gameid, besttimes, leastmoves   # not complete, so on neither board
+    (1, [], [])
+    >>> writer.close()
+    >>> tmp.cleanup()
+    """
+
+    def __init__(self, db, interval=30):
+        super(HistoryWriter, self).__init__(daemon=True)
+        self.db = db
+        self.interval = interval
+        self.queue = queue.Queue()
+        # game: gameid, for games first saved by this writer
+        self.gameids = weakref.WeakKeyDictionary()
+        self.start()
+
+    def save(self, game, time=None, gameid=None, autosave=False):
+        future = Future()
+        record = GameHistory.record(game, time, gameid)
+        self.queue.put(('save', game, record, future, autosave))
+        return future
+
+    def call(self, function):
+        """
+        Runs function(history) on the writer thread once everything
+        queued before it is written. Returns a Future for its result.
+        """
+        future = Future()
+        self.queue.put(('call', function, future))
+        return future
+
+    def flush(self):
+        return self.call(lambda history: None)
+
+    def leaderboards(self, save, count=5):
+        """
+        Future for (gameid, besttimes, leastmoves) once the save() future
+        save is written, for showing a completed game without waiting.
+        """
+        def leaderboards(history):
+            # written by now, it was queued first
+            gameid = save.result()
+            return gameid, history.besttimes(count), history.leastmoves(count)
+        return self.call(leaderboards)
+
+    def close(self):
+        if self.is_alive():
+            self.queue.put(('stop',))
+            self.join()
+
+    def run(self):
+        history = GameHistory(self.db)
+        held = {}   # game: (record, futures)
+        since = None
+        while True:
+            timeout = since and max(0, since + self.interval - time.time())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item and item[0] == 'save':
+                z, game, record, future, autosave = item
+                futures = held.pop(game, (None, []))[1]
+                held[game] = (record, futures + [future])
+                since = since or time.time()
+                if autosave and time.time() < since + self.interval:
+                    continue
+            if held:
+                for game, (record, futures) in held.items():
+                    self._write(history, game, record, futures)
+                held = {}
+                since = None
+            if item and item[0] == 'call':
+                z, function, future = item
+                try:
+                    future.set_result(function(history))
+                except Exception as e:
+                    future.set_exception(e)
+            elif item and item[0] == 'stop':
+                break
+        history.conn.close()
+
+    def _write(self, history, game, record, futures):
+        if not record['gameid']:
+            record['gameid'] = self.gameids.get(game, 0)
+        try:
+            gameid = history.save_record(record)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            self.gameids[game] = gameid
+            for future in futures:
+                future.set_result(gameid)
+
+
+class Stats(object):
+    """
+    Call counts, failures and cumulative time for the methods named in
+    INSTRUMENTED. enable() replaces them with timing wrappers and
+    disable() puts the originals back, so there is no cost while it is
+    off. A call fails if it raises or returns False. Rollbacks counts the
+    moves that failed part way and put the board back. The counters are
+    shared with the HistoryWriter thread, so they are updated under a lock.
+
+    >>> STATS.enable()
+    >>> game = FreecellGame(number=1)
+    >>> game.move('aq')
+    True
+    >>> game.move('as')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    FreecellInvalidMoveError: No cards in 'a' for 9♣
+    >>> snapshot = STATS.snapshot(game)
+    >>> snapshot['methods']['FreecellGame.move']  # doctest: +ELLIPSIS
+    {'calls': 2, 'failures': 1, 'seconds': ...}
+    >>> snapshot['game']['history']
+    2
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> writer = HistoryWriter(os.path.join(tmp.name, 'games.db'))
+    >>> writer.save(game, 5).result()
+    1
+    >>> writer.close()
+    >>> tmp.cleanup()
+    >>> STATS.snapshot()['methods']['GameHistory.save_record']['calls']
+    1
+    >>> STATS.disable()
+    >>> FreecellGame.move is FreecellGame.__dict__['move']
+    True
+    """
+
+    INSTRUMENTED = {
+        'FreecellGame': ['move', 'move_card', 'move_stack', 'set_state',
+                         'undo', 'draw_board'],
+        'GameHistory': ['add', 'add_many', 'get', 'remove', 'save', 'resume',
+                        'save_record', 'besttimes', 'leastmoves',
+                        'unfinished', 'select', 'add_grades', 'get_grade'],
+    }
+
+    def __init__(self):
+        self.enabled = False
+        self.originals = {}
+        # name: [calls, failures, seconds]
+        self.methods = {}
+        self.rollbacks = 0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            for counts in self.methods.values():
+                counts[:] = [0, 0, 0.0]
+            self.rollbacks = 0
+
+    def enable(self):
+        if self.enabled:
+            return
+        for cls_name, names in self.INSTRUMENTED.items():
+            cls = globals()[cls_name]
+            for name in names:
+                method = cls.__dict__[name]
+                self.originals[(cls, name)] = method
+                setattr(cls, name, self._wrap(cls_name + '.' + name, method))
+        self.enabled = True
+
+    def disable(self):
+        for (cls, name), method in self.originals.items():
+            setattr(cls, name, method)
+        self.originals = {}
+        self.enabled = False
+
+    def _wrap(self, name, method):
+        counts = self.methods.setdefault(name, [0, 0, 0.0])
+        clock = time.perf_counter
+        lock = self.lock
+        def wrapper(*args, **kwargs):
+            failed = True
+            began = clock()
+            try:
+                result = method(*args, **kwargs)
+                failed = result is False
+            finally:
+                took = clock() - began
+                with lock:
+                    counts[0] += 1
+                    counts[1] += failed
+                    counts[2] += took
+            return result
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    def snapshot(self, game=None):
+        """
+        The counters as a dict, with the size of game's undo history if
+        a game is given. bytes is approximate: the starting Board and the
+        moves logged after it.
+        """
+        with self.lock:
+            snapshot = {
+                'enabled': self.enabled,
+                'rollbacks': self.rollbacks,
+                'methods': dict(
+                    (name, {'calls': c[0], 'failures': c[1], 'seconds': c[2]})
+                    for name, c in sorted(self.methods.items()) if c[0]
+                ),
+            }
+        if game:
+            size = sys.getsizeof(game.history)
+            for entry in game.history:
+                size += sys.getsizeof(entry)
+                size += sum(sys.getsizeof(part) for part in entry)
+                if isinstance(entry, Board):
+                    size += sum(sys.getsizeof(c) for c in entry.columns)
+            snapshot['game'] = {
+                'history': len(game.history),
+                'replay': len(game.replay),
+                'bytes': size,
+            }
+        return snapshot
+
+    def pp(self, game=None):
+        snapshot = self.snapshot(game)
+        lines = ['{:<26} {:>8} {:>8} {:>10} {:>10}'.format(
+            'method', 'calls', 'failed', 'total ms', 'avg us'
+        )]
+        for name, m in snapshot['methods'].items():
+            lines.append('{:<26} {:>8} {:>8} {:>10.1f} {:>10.1f}'.format(
+                name, m['calls'], m['failures'], m['seconds'] * 1e3,
+                m['seconds'] / m['calls'] * 1e6
+            ))
+        lines.append('rollbacks: {}'.format(snapshot['rollbacks']))
+        if game:
+            lines.append('history: {history} entries, {bytes} bytes, replay:'
+                         ' {replay} moves'.format(**snapshot['game']))
+        if not self.enabled:
+            lines.append("stats are off, 'stats on' to start counting")
+        print('\n'.join(lines))
+
+STATS = Stats()
 
 
 if __name__ == '__main__':
@@ -775,25 +2508,118 @@ if __name__ == '__main__':
                            " card width when the suit symbols take up less"
                            " room on screen than their actual width. You will"
                            " most likely have to set this to 2.")
+    parser.add_option('-g', '--grade', metavar='FIRST-LAST',
+                      help="Solve a range of Microsoft deal numbers and store"
+                           " the results in the game history database")
+    parser.add_option('--grade-file', metavar='FILE',
+                      help="Solve the decks in FILE, one per line")
+    parser.add_option('--workers', type="int", default=None,
+                      help="Number of solver processes (default: one per cpu)")
+    parser.add_option('--max-nodes', type="int", default=200000,
+                      help="Give up on a deal after expanding this many"
+                           " positions")
+    parser.add_option('--autoplay', action='store_true', default=False,
+                      help="Play safe cards to the foundations after each move")
+    parser.add_option('--autosave', type="float", metavar='SECONDS',
+                      help="Save the game in progress at most every SECONDS"
+                           " ('q' then keeps the last autosave)")
+    parser.add_option('--pool', type="int", default=0, metavar='SIZE',
+                      help="Keep SIZE deals the solver has won ready for 'n'"
+                           " (default: deal any shuffle)")
+    parser.add_option('--stats', action='store_true', default=False,
+                      help="Count and time calls to the engine, see 'stats'")
+    parser.add_option('--export', metavar='FILE',
+                      help="Write the game history to FILE as JSON lines, or"
+                           " CSV if FILE ends in .csv ('-' for stdout)")
+    parser.add_option('--import', dest='import_file', metavar='FILE',
+                      help="Add the games in FILE, written by --export, to the"
+                           " game history")
     options, args = parser.parse_args()
 
+    if options.stats:
+        STATS.enable()
+
     if options.test:
         import doctest
         doctest.testmod()
+    elif options.export or options.import_file:
+        history = GameHistory(options.db)
+        path = options.export or options.import_file
+        fmt = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        if options.export:
+            out = sys.stdout if path == '-' else open(path, 'w', newline='')
+            count = history.export_games(out, fmt)
+            if out is not sys.stdout:
+                out.close()
+            action = 'Exported'
+        else:
+            infile = sys.stdin if path == '-' else open(path, newline='')
+            count = history.import_games(infile, fmt)
+            action = 'Imported'
+        print(colorize('{} {} games'.format(action, count), fg='yel'),
+              file=sys.stderr)
+    elif options.grade or options.grade_file:
+        from solver import grade_deals
+        if options.grade:
+            first, z, last = options.grade.partition('-')
+            numbers = range(int(first), int(last or first) + 1)
+            deals = ((n, repr(FreecellDeck(n))) for n in numbers)
+        else:
+            lines = (l.strip() for l in open(options.grade_file))
+            deals = ((None, l) for l in lines if l and not l.startswith('#'))
+        history = GameHistory(options.db)
+        began = time.time()
+        counts = {1: 0, 0: 0, None: 0}
+        for r in grade_deals(history, deals, workers=options.workers,
+                             max_nodes=options.max_nodes):
+            counts[r['solvable']] += 1
+            status = {1: 'solved', 0: 'unsolvable', None: 'gave up'}
+            print('{:>8} {:<10} {:>5} moves {:>8} nodes {:>7.2f}s'.format(
+                r['dealnum'] or '', status[r['solvable']], r['length'] or '-',
+                r['nodes'], r['seconds']
+            ))
+        print(colorize(
+            '{} solved, {} unsolvable, {} gave up in {:.1f}s'.format(
+                counts[1], counts[0], counts[None], time.time() - began
+            ), fg='yel'
+        ))
     else:
         readline.parse_and_bind('tab: complete')
+        # ';' is a column letter
+        python_delims = readline.get_completer_delims()
+        readline.set_completer_delims(' ')
+
+        def complete(text, state):
+            matches = game.completions(text) if game else []
+            return matches[state] if state < len(matches) else None
+
+        readline.set_completer(complete)
+        if options.pool:
+            from solver import DealPool
+            pool = DealPool(options.pool, db=options.db)
+        else:
+            pool = None
         history = GameHistory(options.db)
+        # games are written from another thread, history is for reading
+        writer = HistoryWriter(options.db, options.autosave or 30)
         start = datetime.now()
         game = None
         move = None
         gameid = None
+        # the game whose completion was saved, and its results on the way
+        finished = None
+        completed = []
+        autoplay = options.autoplay
+        renderer = BoardRenderer(options.width, options.offset)
+        drawn = False
         call(['clear'])
         gamehelp =  "Type 'n' to start a game. Type 2 letters to move card from\n" \
                     "spot to another, first the letter near the 'from' pile, then\n" \
                     "the letter near the 'to' pile, then hit Enter.\n" \
                     "You can type more letter pairs before you hit Enter and\n" \
                     "it will do them all in sequence.\n" \
-                    "   n -- new game\n" \
+                    "   n -- new game (with --pool, a deal the solver has won)\n" \
+                    "   deal n -- new game with Microsoft FreeCell deal # n\n" \
                     "   save -- save game and quit\n" \
                     "   q -- quit without saving\n" \
                     "   a/s/d/f/j/k/l/; -- from/to column\n" \
@@ -802,9 +2628,13 @@ if __name__ == '__main__':
                     "   u/i/o/p -- from/to specific foundation\n" \
                     "   h/t -- to appropriate foundation for from card\n" \
                     "   m -- make all possible foundation moves\n" \
+                    "   auto -- turn playing safe cards to foundations on/off\n" \
                     "   z -- undo (zz to use in same string as other moves)\n" \
+                    "   tab -- show or finish the legal moves\n" \
                     "   show -- enter cmd with no args for 'show' help\n" \
                     "   play n restart|resume -- restart/resume game # n\n" \
+                    "   hint [ms] -- suggest a move, thinking for up to ms\n" \
+                    "   stats [on|off|reset] -- time spent in the engine\n" \
                     "   ?/help -- show this help\n" \
                     "   py -- enter python interpreter... mostly for inspecting\n" \
                     "         game and history objects\n"
@@ -819,6 +2649,32 @@ if __name__ == '__main__':
 
         while True:
 
+            # anything printed since the last frame has moved the board
+            if not drawn:
+                renderer.invalidate()
+            drawn = False
+
+            while completed and completed[0][0].done():
+                results, duration, moves = completed.pop(0)
+                try:
+                    done_id, besttimes, leastmoves = results.result()
+                except Exception as e:
+                    print(colorize(
+                        "Error: game not saved: {}".format(e), fg='red'
+                    ))
+                    continue
+                if finished is game:
+                    gameid = done_id
+                print(colorize(
+                    "\nCompleted Game #{}!\nTime: {}\nMoves: {}" \
+                    .format(done_id, duration, moves),
+                    fg='yel'
+                ))
+                print(colorize("\nBest Times:", fg='yel'))
+                history.pp(besttimes, mark=(0, done_id))
+                print(colorize("\nLeast Moves:", fg='yel'))
+                history.pp(leastmoves, mark=(0, done_id))
+
             try:
                 raw_move = input(colorize('move> ', fg='mag'))
             except KeyboardInterrupt:
@@ -835,16 +2691,20 @@ if __name__ == '__main__':
 
             if move in ['save']:
                 duration = datetime.now() - start
-                print(history.save(game, duration.total_seconds(), gameid))
+                print(writer.save(game, duration.total_seconds(), gameid).result())
                 break
 
             if move == 'py':
                 intro = "python interpreter\n" \
                         "enter 'q' to quit and return to move interpreter\n"
                 print(colorize(intro, fg='yel'))
+                readline.set_completer(rlcompleter.Completer().complete)
+                readline.set_completer_delims(python_delims)
                 while True:
                     move = input(colorize('>>> ', fg='blu'))
                     if move.lower() in ['q','quit','exit']:
+                        readline.set_completer(complete)
+                        readline.set_completer_delims(' ')
                         if game and not game.complete():
                             print(colorize("press enter again to see board", fg='yel'))
                         break
@@ -879,7 +2739,9 @@ if __name__ == '__main__':
                     opts = ['q', 'last']
                 action = opts[1]
                 count = 5 if len(opts) < 3 else opts[2]
-                mark = None if not gameid else (0, gameid)
+                # autosaves of a new game have an id only the writer knows
+                current = gameid or game is not None and writer.gameids.get(game)
+                mark = None if not current else (0, current)
                 if action == 'saved':
                     result = history.unfinished()
                     heading = 'Saved Games'
@@ -927,13 +2789,68 @@ if __name__ == '__main__':
                 history.pp(result, mark=mark)
                 continue
 
+            if move.startswith('stats'):
+                action = move.split()[1:] or ['show']
+                if action[0] == 'on':
+                    STATS.enable()
+                elif action[0] == 'off':
+                    STATS.disable()
+                elif action[0] == 'reset':
+                    STATS.reset()
+                STATS.pp(game)
+                continue
+
+            if move.split()[:1] == ['hint']:
+                if not game or game.complete():
+                    continue
+                try:
+                    budget = int(move.split()[1])
+                except IndexError:
+                    budget = 100
+                except ValueError:
+                    print("To get a hint type: 'hint [milliseconds]'")
+                    continue
+                print(colorize('hint: {}'.format(game.hint(budget)), fg='cyan'))
+                continue
+
+            if move == 'auto':
+                autoplay = not autoplay
+                if game:
+                    game.autoplay = autoplay
+                print(colorize(
+                    'autoplay {}'.format('on' if autoplay else 'off'), fg='yel'
+                ))
+                continue
+
             if not move and not game:
                 continue
 
             if move in ['n','new']:
                 start = datetime.now()
                 gameid = None
-                game = FreecellGame()
+                if pool:
+                    deck, grade = pool.pop()
+                    if not grade:
+                        print(colorize(
+                            "The pool is still filling, this deal may not"
+                            " be winnable", fg='cyan'
+                        ))
+                    game = FreecellGame(deck)
+                else:
+                    game = FreecellGame()
+                game.autoplay = autoplay
+            elif move.startswith('deal ') and len(move.split()) == 2:
+                try:
+                    number = int(move.split()[1])
+                    dealt = FreecellGame(number=number)
+                except ValueError:
+                    print("To play a numbered deal type: 'deal <1-{}>'"
+                          .format(MS_MAX_DEAL))
+                    continue
+                start = datetime.now()
+                gameid = None
+                game = dealt
+                game.autoplay = autoplay
             elif move.startswith('play'):
                 try:
                     z, gameid, begin = move.split()
@@ -944,13 +2861,15 @@ if __name__ == '__main__':
                     record = history.get(gameid)
                     if record:
                         gameid = int(gameid) # for 'mark' arg to history.pp()
-                        gdeck = record[0][history.I_DECK]
-                        game = FreecellGame(gdeck)
                         if begin == 'resume':
-                            greplay = record[0][history.I_REPLAY]
+                            game = history.resume(gameid)
                             gtime = record[0][history.I_TIME]
-                            game.move(greplay)
                             start = datetime.now() - timedelta(seconds=gtime)
+                        else:
+                            game = FreecellGame(record[0][history.I_DECK])
+                        game.autoplay = autoplay
+                        if record[0][history.I_COMPL]:
+                            finished = game
                     else:
                         print("Game {} does not exist".format(gameid))
                         continue
@@ -976,25 +2895,29 @@ if __name__ == '__main__':
                 # resumed games have a gameid but need duration updated
                 # ... so need to make sure we save same game not new game
                 # empty/invalid moves after end of game need to do nothing
-                saved = gameid and history.get(gameid)[0][history.I_COMPL]
-                if not saved:
-                    finish = datetime.now()
-                    duration = finish - start
+                if finished is not game:
+                    finished = game
+                    duration = datetime.now() - start
                     # this will save resumed game if gameid, otherwise it
-                    # will save a new game
-                    gameid = history.save(game, duration.total_seconds(), gameid)
+                    # will save a new game (or the one autosaves started);
+                    # the results are shown at the next prompt
+                    save = writer.save(game, duration.total_seconds(), gameid)
+                    completed.append(
+                        (writer.leaderboards(save), duration, len(game.replay))
+                    )
                     print(colorize(
-                        "\nCompleted Game #{}!\nTime: {}\nMoves: {}" \
-                        .format(gameid, duration, len(game.replay)),
-                        fg='yel'
+                        "\nCompleted! Hit Enter for the best times.", fg='yel'
                     ))
-                    print(colorize("\nBest Times:", fg='yel'))
-                    history.pp(history.besttimes(5), mark=(0, gameid))
-                    print(colorize("\nLeast Moves:", fg='yel'))
-                    history.pp(history.leastmoves(5), mark=(0, gameid))
                 continue
             else:
-                call(['clear'])
-                print("--------")
-                print(game.draw_board(options.width, options.offset))
-                print("--------")
+                renderer.render(game)
+                drawn = True
+                if options.autosave:
+                    duration = datetime.now() - start
+                    writer.save(game, duration.total_seconds(), gameid,
+                                autosave=True)
+
+        # write anything still queued
+        writer.close()
+        if pool:
+            pool.close()
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+
+"""
+Best-first search for FreecellGame positions.
+
+The solver works on plain tuples of card ids rather than FreecellGame
+objects: a position is (foundation, cells, columns), where foundation is
+the number of cards on each foundation in FreecellGame.mv_found_order,
+cells is four card ids (None when empty) and columns is eight tuples of
+card ids, bottom card first. A card id is suit.id * 13 + rank.id, as in
+carddeck.Card.
+
+Moves follow the rules FreecellGame.move() applies, including how many
+cards a stack move may carry, so a solution can be replayed with
+game.move(solution).
+
+>>> cards = '8C,7D,10H,6D,KS,4S,5S,9C,7H,6H,AC,JS,7C,5H,AD,2D,3S,AS,QS,10S,2S,8H,8S,9S,9D,3C,10C,9H,3D,2H,QD,5C,KD,JD,JC,AH,6C,4H,7S,QC,5D,4C,10D,4D,QH,8D,3H,6S,KH,KC,2C,JH'
+>>> game = FreecellGame(cards)
+>>> solver = Solver(game)
+>>> moves = solver.solve()
+>>> solver.status
+'solved'
+>>> game.move(moves)
+True
+>>> game.complete()
+True
+"""
+
+import heapq
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from freecell import FreecellGame, FreecellDeck, GameHistory, RED_SUITS, \
+    safe_to_foundation
+
+COLS = FreecellGame.mv_cols
+CELLS = FreecellGame.mv_cells[:4]
+FOUNDS = FreecellGame.mv_found[:4]
+
+def is_red(card):
+    return card // 13 in RED_SUITS
+
+def fits_on(card, onto):
+    """card can be placed on onto in a column"""
+    return card % 13 == onto % 13 - 1 and is_red(card) != is_red(onto)
+
+def run_length(column):
+    """number of cards in the ordered alternating-color run on top"""
+    length = len(column)
+    if not length:
+        return 0
+    n = 1
+    while n < length and fits_on(column[-n], column[-n - 1]):
+        n += 1
+    return n
+
+def unpack(state):
+    """position tuple from FreecellGame.get_state()"""
+    foundation = tuple(state[0:4])
+    cells = tuple(c - 1 if c else None for c in state[4:8])
+    columns = []
+    start = 16
+    for length in state[8:16]:
+        columns.append(tuple(c - 1 for c in state[start:start + length]))
+        start += length
+    return foundation, cells, tuple(columns)
+
+def position_key(foundation, cells, columns):
+    """transposition key; ignores the order of free cells and columns"""
+    return (
+        foundation,
+        tuple(sorted(c for c in cells if c is not None)),
+        tuple(sorted(columns)),
+    )
+
+
+# Heuristics estimate how far a position is from solved, lower is better.
+
+def h_foundation(foundation, cells, columns):
+    return 52 - sum(foundation)
+
+def h_freecells(foundation, cells, columns):
+    return 4 - cells.count(None)
+
+def h_empty_columns(foundation, cells, columns):
+    return sum(1 for c in columns if c)
+
+def h_runs(foundation, cells, columns):
+    """cards that are not part of the ordered run on top of their column"""
+    return sum(len(c) - run_length(c) for c in columns)
+
+def h_blockers(foundation, cells, columns):
+    """cards sitting on top of the next card each foundation needs"""
+    total = 0
+    for column in columns:
+        for depth, card in enumerate(column):
+            suit, rank = divmod(card, 13)
+            if rank == foundation[suit]:
+                total += len(column) - depth - 1
+    return total
+
+HEURISTICS = {
+    'foundation': h_foundation,
+    'freecells': h_freecells,
+    'empty_columns': h_empty_columns,
+    'runs': h_runs,
+    'blockers': h_blockers,
+}
+
+DEFAULT_WEIGHTS = {
+    'foundation': 5,
+    'freecells': 2,
+    'empty_columns': 1,
+    'runs': 1,
+    'blockers': 2,
+}
+
+def weighted(weights):
+    """combine named HEURISTICS into one function"""
+    parts = [(HEURISTICS[name], w) for name, w in weights.items() if w]
+    def heuristic(foundation, cells, columns):
+        return sum(w * h(foundation, cells, columns) for h, w in parts)
+    return heuristic
+
+
+class Solver(object):
+    """
+    Best-first search from the current position of a FreecellGame.
+
+    heuristic may be a function taking (foundation, cells, columns), the
+    name of one of HEURISTICS, or a dict of {name: weight}. Each expanded
+    position costs depth_weight per move made to reach it on top of the
+    heuristic, so 0 is a pure greedy search and larger values trade speed
+    for shorter solutions.
+
+    The search stops when it has expanded max_nodes positions, run for
+    max_seconds, or holds max_states positions in its transposition
+    table (which is where the memory goes). Cards that are safe to play
+    are moved to the foundations as soon as they are exposed.
+
+    After solve(), status is 'solved', 'unsolvable' when every reachable
+    position was searched, or 'limit' when the search was cut short. In
+    that case partial holds the moves to the position the heuristic
+    liked best.
+    """
+
+    def __init__(self, game, heuristic=None, depth_weight=0.5,
+                 max_nodes=200000, max_seconds=None, max_states=1000000):
+        if hasattr(game, 'get_state'):
+            game = game.get_state()
+        self.start = unpack(game)
+        if heuristic is None:
+            heuristic = DEFAULT_WEIGHTS
+        if isinstance(heuristic, str):
+            heuristic = HEURISTICS[heuristic]
+        elif isinstance(heuristic, dict):
+            heuristic = weighted(heuristic)
+        self.heuristic = heuristic
+        self.depth_weight = depth_weight
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.max_states = max_states
+        self.nodes = 0
+        self.elapsed = 0
+        self.status = None
+        self.partial = None
+
+    def solve(self):
+        """returns the solution as a move string, or None"""
+        began = time.time()
+        deadline = self.max_seconds and began + self.max_seconds
+        position, moves = self.autoplay(*self.start)
+        key = position_key(*position)
+        parents = {key: (None, moves)}
+        best = (self.heuristic(*position), key)
+        counter = 0
+        queue = [(0, counter, 0, position, key)]
+        self.nodes = 0
+        self.status = 'unsolvable'
+
+        while queue:
+            priority, z, depth, position, key = heapq.heappop(queue)
+            if sum(position[0]) == 52:
+                self.status = 'solved'
+                break
+            self.nodes += 1
+            if self.nodes > self.max_nodes or len(parents) > self.max_states \
+                    or (deadline and time.time() > deadline):
+                self.status = 'limit'
+                break
+            for move, child in self.successors(*position):
+                child, auto = self.autoplay(*child)
+                child_key = position_key(*child)
+                if child_key in parents:
+                    continue
+                parents[child_key] = (key, move + auto)
+                counter += 1
+                estimate = self.heuristic(*child)
+                if estimate < best[0]:
+                    best = (estimate, child_key)
+                score = estimate + self.depth_weight * (depth + 1)
+                heapq.heappush(
+                    queue, (score, counter, depth + 1, child, child_key)
+                )
+
+        self.elapsed = time.time() - began
+        if self.status != 'solved':
+            self.partial = self.path(parents, best[1])
+            return None
+        return self.path(parents, key)
+
+    def path(self, parents, key):
+        """the moves from the start to the position key"""
+        path = []
+        while key is not None:
+            key, moves = parents[key]
+            path.append(moves)
+        path.reverse()
+        return ''.join(path)
+
+    def autoplay(self, foundation, cells, columns):
+        """
+        Plays every safe card to the foundations. Returns the new position
+        and the moves made.
+        """
+        moves = []
+        played = True
+        while played:
+            played = False
+            for i, column in enumerate(columns):
+                if column and safe_to_foundation(column[-1], foundation):
+                    suit = column[-1] // 13
+                    foundation = add_one(foundation, suit)
+                    columns = replace(columns, i, column[:-1])
+                    moves.append(COLS[i] + FOUNDS[suit])
+                    played = True
+            for j, card in enumerate(cells):
+                if card is not None and safe_to_foundation(card, foundation):
+                    suit = card // 13
+                    foundation = add_one(foundation, suit)
+                    cells = replace(cells, j, None)
+                    moves.append(CELLS[j] + FOUNDS[suit])
+                    played = True
+        return (foundation, cells, columns), ''.join(moves)
+
+    def successors(self, foundation, cells, columns):
+        """yields (move, position) for every useful move"""
+        free = cells.count(None)
+        empty = [i for i, c in enumerate(columns) if not c]
+        capacity = free + len(empty)
+        open_cell = cells.index(None) if free else None
+
+        for j, card in enumerate(cells):
+            if card is None:
+                continue
+            suit = card // 13
+            if foundation[suit] == card % 13:
+                yield CELLS[j] + FOUNDS[suit], (
+                    add_one(foundation, suit), replace(cells, j, None), columns
+                )
+            for i, column in enumerate(columns):
+                if column and not fits_on(card, column[-1]):
+                    continue
+                if not column and i != empty[0]:
+                    continue
+                yield CELLS[j] + COLS[i], (
+                    foundation,
+                    replace(cells, j, None),
+                    replace(columns, i, column + (card,)),
+                )
+
+        for i, column in enumerate(columns):
+            if not column:
+                continue
+            card = column[-1]
+            suit = card // 13
+            if foundation[suit] == card % 13:
+                yield COLS[i] + FOUNDS[suit], (
+                    add_one(foundation, suit),
+                    cells,
+                    replace(columns, i, column[:-1]),
+                )
+
+            run = run_length(column)
+            for k, dest in enumerate(columns):
+                if k == i:
+                    continue
+                if dest:
+                    count = dest[-1] % 13 - card % 13
+                    if count < 1 or count > run or count > capacity + 1:
+                        continue
+                    if not fits_on(column[-count], dest[-1]):
+                        continue
+                else:
+                    if k != empty[0]:
+                        continue
+                    count = min(run, capacity)
+                    if count == len(column):
+                        continue
+                yield COLS[i] + COLS[k], (
+                    foundation,
+                    cells,
+                    replace(
+                        replace(columns, i, column[:-count]),
+                        k, dest + column[-count:]
+                    ),
+                )
+
+            if open_cell is not None:
+                yield COLS[i] + CELLS[open_cell], (
+                    foundation,
+                    replace(cells, open_cell, card),
+                    replace(columns, i, column[:-1]),
+                )
+
+
+def add_one(foundation, suit):
+    return foundation[:suit] + (foundation[suit] + 1,) + foundation[suit + 1:]
+
+def replace(items, index, value):
+    return items[:index] + (value,) + items[index + 1:]
+
+
+def solve(game, **kwargs):
+    """
+    Solves from the current position of game and returns the moves as a
+    string for game.move(), or None. Takes the same options as Solver.
+    """
+    return Solver(game, **kwargs).solve()
+
+
+def grade(job):
+    """
+    Solves one deal for grade_deals(). job is (dealnum, deck, options)
+    and the result is a row for GameHistory.add_grades().
+    """
+    dealnum, deck, options = job
+    solver = Solver(FreecellGame(deck), **options)
+    moves = solver.solve()
+    if solver.status == 'solved':
+        solvable = 1
+    elif solver.status == 'unsolvable':
+        solvable = 0
+    else:
+        solvable = None
+    return {
+        'deck': deck,
+        'dealnum': dealnum,
+        'solvable': solvable,
+        'length': moves and len(moves) // 2,
+        'nodes': solver.nodes,
+        'seconds': solver.elapsed,
+        'solution': moves,
+    }
+
+def grade_deals(history, deals, workers=None, batch_size=100, **options):
+    """
+    Grades (dealnum, deck) pairs across a pool of worker processes and
+    writes the results to history in batches. dealnum may be None for
+    decks that did not come from a deal number. Yields each result as it
+    is written.
+    """
+    jobs = ((dealnum, deck, options) for dealnum, deck in deals)
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(grade, jobs, chunksize=4):
+            batch.append(result)
+            if len(batch) >= batch_size:
+                history.add_grades(batch)
+                for r in batch:
+                    yield r
+                batch = []
+    if batch:
+        history.add_grades(batch)
+        for r in batch:
+            yield r
+
+
+class DealPool(object):
+    """
+    Keeps up to size shuffled deals that the solver has won, graded in
+    the background by worker processes, so a new game can start on a
+    winnable deal straight away. With a db every grade, won or not, is
+    stored in its dealgrades table. options are passed on to Solver.
+    The workers are spawned rather than forked, as the caller may already
+    be running threads.
+
+    >>> pool = DealPool(size=1)
+    >>> deck, grade = pool.pop(timeout=60)
+    >>> grade['solvable'], grade['deck'] == deck
+    (1, True)
+    >>> pool.close()
+    """
+
+    def __init__(self, size=3, workers=1, db=None, **options):
+        options.setdefault('max_nodes', 50000)
+        self.options = options
+        self.db = db
+        self.workers = workers
+        self.ready = queue.Queue(maxsize=size)
+        self.closed = False
+        self.pool = multiprocessing.get_context('spawn').Pool(workers)
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        history = self.db and GameHistory(self.db)
+        while not self.closed:
+            jobs = []
+            for n in range(self.workers):
+                deck = FreecellDeck()
+                deck.shuffle()
+                jobs.append((None, repr(deck), self.options))
+            try:
+                results = self.pool.map(grade, jobs)
+            except Exception:
+                # the pool was closed under us
+                break
+            if history:
+                history.add_grades(results)
+            for result in results:
+                if result['solvable'] and not self.closed:
+                    self.ready.put(result)
+
+    def pop(self, timeout=0):
+        """
+        Returns (deck, grade) for a winnable deal, waiting up to timeout
+        seconds for one. If none is ready it returns a deal that has not
+        been checked, with None for the grade.
+        """
+        try:
+            result = self.ready.get(timeout=timeout) if timeout \
+                else self.ready.get_nowait()
+        except queue.Empty:
+            deck = FreecellDeck()
+            deck.shuffle()
+            return repr(deck), None
+        return result['deck'], result
+
+    def close(self):
+        self.closed = True
+        self.pool.terminate()
+        # let fill() past a full queue so it sees closed
+        try:
+            self.ready.get_nowait()
+        except queue.Empty:
+            pass
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()